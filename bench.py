@@ -0,0 +1,158 @@
+#!/usr/bin/python
+"""Headless frame-time benchmark for the demos.
+
+Usage: bench.py [-n frames] [-s WIDTHxHEIGHT] [--seed N] [-o results.json]
+                [--compare old.json] [demo ...]
+
+Each demo runs in its own process under SDL's dummy video and audio
+drivers, so nothing opens on the screen.  The display is an offscreen
+32-bit surface (of the size given with -s if the demo asks for the
+whole screen), the random number generators are seeded, the event
+queue is always empty, and pygame.time.delay and wait return
+immediately.  Every display.flip or display.update counts as a frame,
+and after the requested number of frames the demo is stopped.  A demo
+that blocks in pygame.event.wait would wait forever, so it is stopped
+there too and reported as idle.
+
+A demo can be given with arguments, quoted, like 'ondas.py --table',
+to compare alternative engines.  Results go to the terminal and,
+with -o, to a JSON file; --compare prints the speed relative to an
+earlier JSON file, so that you can see regressions between
+revisions.
+"""
+
+import sys, os, time, json, subprocess, tempfile, optparse
+
+default_demos = ['ondas.py', 'klappquadrat.py', 'sier.py', 'circles.py',
+                 'ellipses.py', 'pygmusic.py']
+
+class Done(Exception):
+    "Raised from inside the demo once it has shown enough frames."
+
+class Idle(Done):
+    "Raised from inside the demo when it waits for an event."
+
+def percentile(values, percent):
+    "Nearest-rank percentile of a sorted list."
+    if not values: return 0
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+def run_child(outfile, frames, size, seed, demo, args):
+    "Run one demo in this process, writing the measurements to outfile."
+    import random, resource, runpy, pygame
+    random.seed(seed)
+    try:
+        import numpy
+        numpy.random.seed(seed)
+    except ImportError: pass
+
+    flips = []
+    real_set_mode = pygame.display.set_mode
+    def set_mode(resolution=(0, 0), flags=0, depth=0):
+        if tuple(resolution) == (0, 0): resolution = size
+        return real_set_mode(resolution, 0, 32)
+    def flip(*rects):
+        flips.append(time.time())
+        if len(flips) > frames: raise Done()
+    pygame.display.set_mode = set_mode
+    pygame.display.flip = pygame.display.update = flip
+    pygame.event.poll = lambda: pygame.event.Event(pygame.NOEVENT)
+    def wait():
+        raise Idle()
+    pygame.event.wait = wait
+    pygame.event.get = lambda *args: []
+    pygame.time.delay = pygame.time.wait = lambda ms: 0
+
+    result = {'demo': ' '.join([demo] + args)}
+    sys.argv = [demo] + args
+    start = time.time()
+    try: runpy.run_path(demo, run_name='__main__')
+    except Idle: result['idle'] = True
+    except Done: pass
+    except BaseException, e: result['error'] = '%s: %s' % (type(e).__name__, e)
+    # the first frame includes all the setup
+    intervals = sorted(b - a for a, b in zip(flips, flips[1:]))
+    if flips: result['first_frame_ms'] = (flips[0] - start) * 1000
+    result['frames'] = len(intervals)
+    if intervals:
+        result['fps'] = len(intervals) / (flips[-1] - flips[0])
+        for percent in 50, 95, 99:
+            result['p%d_ms' % percent] = percentile(intervals, percent) * 1000
+        result['max_ms'] = intervals[-1] * 1000
+    result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(outfile, 'w') as output: json.dump(result, output)
+    os._exit(0)                         # don't wait for the demo's threads
+
+def bench(demo, frames, size, seed, timeout=300):
+    "Run one demo in a child process and return its measurements."
+    words = demo.split()
+    fd, outfile = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    env = dict(os.environ, SDL_VIDEODRIVER='dummy', SDL_AUDIODRIVER='dummy')
+    devnull = open(os.devnull, 'w')
+    child = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                              '--child', outfile, str(frames),
+                              '%dx%d' % size, str(seed)] + words,
+                             env=env, stdout=devnull,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    deadline = time.time() + timeout
+    while child.poll() is None and time.time() < deadline: time.sleep(0.05)
+    if child.poll() is None: child.kill()
+    try:
+        with open(outfile) as input: return json.load(input)
+    except ValueError:
+        return {'demo': demo, 'error': 'exited with status %s' % child.poll()}
+    finally:
+        os.unlink(outfile)
+
+header = '%-28s %8s %8s %8s %8s %8s %9s' % (
+    'demo', 'fps', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms', 'peak MB')
+
+def report(result, old=None):
+    "Print a line of results, compared to an old result if any."
+    if 'fps' not in result:
+        print '%-28s %s' % (result['demo'], result.get('error'))
+        return
+    line = '%-28s %8.1f %8.2f %8.2f %8.2f %8.2f %9.1f' % (
+        result['demo'], result['fps'], result['p50_ms'], result['p95_ms'],
+        result['p99_ms'], result['max_ms'], result['peak_rss_kb'] / 1024.)
+    if old and old.get('fps'):
+        line += '  %+.0f%%' % (100 * (result['fps'] / old['fps'] - 1))
+    if 'error' in result: line += '  ' + result['error']
+    if result.get('idle'): line += '  idle after %d frames' % result['frames']
+    print line
+
+def main(argv):
+    if argv[1:2] == ['--child']:
+        outfile, frames, size, seed, demo = argv[2:7]
+        run_child(outfile, int(frames), tuple(map(int, size.split('x'))),
+                  int(seed), demo, argv[7:])
+    usage = __doc__.split('\n\n')[1][len('Usage: '):]
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('-n', '--frames', type='int', default=300)
+    parser.add_option('-s', '--size', default='640x480')
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('-o', '--output')
+    parser.add_option('--compare')
+    options, demos = parser.parse_args(argv[1:])
+    size = tuple(map(int, options.size.split('x')))
+    baseline = {}
+    if options.compare:
+        with open(options.compare) as input:
+            baseline = dict((result['demo'], result)
+                            for result in json.load(input)['results'])
+    print header
+    results = []
+    for demo in demos or default_demos:
+        results.append(bench(demo, options.frames, size, options.seed))
+        report(results[-1], baseline.get(results[-1]['demo']))
+    if options.output:
+        import pygame
+        with open(options.output, 'w') as output:
+            json.dump({'frames': options.frames, 'size': size,
+                       'seed': options.seed, 'time': time.time(),
+                       'python': sys.version.split()[0],
+                       'pygame': pygame.version.ver,
+                       'results': results}, output, indent=1)
+
+if __name__ == '__main__': main(sys.argv)
@@ -1,23 +1,30 @@
 #!/usr/bin/python
+# Uso: circles.py [cantidad de circulos]
 from pygame import *
 from random import randrange as rand
+import sys
+from sprites import Sprites
 
 pantalla = display.set_mode((0, 0), FULLSCREEN)
 ww, hh = pantalla.get_size()
+cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 20
 
-circles = []
-for ii in range(20):
-    ss = rand(500)
-    surface = Surface((ss, ss), SRCALPHA)
-    draw.ellipse(surface,
-                 Color(rand(256), rand(256), rand(256), 32),
-                 surface.get_rect())
-    circles.append((surface, { 'x': rand(ww),  'y': rand(hh),
-                              'dx': rand(10), 'dy': rand(10)}))
+imagenes, posiciones, velocidades = [], [], []
+for ii in range(cantidad):
+    if ii < 20:
+        ss = rand(500)
+        surface = Surface((ss, ss), SRCALPHA)
+        draw.ellipse(surface,
+                     Color(rand(256), rand(256), rand(256), 32),
+                     surface.get_rect())
+    else:                               # miles de circulos, 20 imagenes
+        surface = imagenes[rand(20)]
+    imagenes.append(surface)
+    posiciones.append((rand(ww), rand(hh)))
+    velocidades.append((rand(10), rand(10)))
+circles = Sprites((ww, hh), imagenes, posiciones, velocidades)
 
 while event.poll().type not in (QUIT, MOUSEBUTTONDOWN):
-    for surface, estado in circles:
-        pantalla.blit(surface, (estado['x'], estado['y']))
-        estado['x'] = (estado['x'] + estado['dx']) % ww
-        estado['y'] = (estado['y'] + estado['dy']) % hh
+    circles.draw(pantalla)              # un solo blits para todos
+    circles.step()                      # y un solo paso de numpy
     display.flip()
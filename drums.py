@@ -1,18 +1,55 @@
 #!/usr/bin/python
 # md5sum $(locate -b .wav) | sort | uniq -w 32 | sort -R | awk '{print $2}' | head -36 | while read sound; do cp "$sound" sounds/.; done
+# Uso: drums.py [--low-latency]
 from pygame import *
-import string, os
+import string, sys
+from time import time as ahora
+from samplebank import SampleBank
+from polyphony import VoiceAllocator
 
+baja_latencia = '--low-latency' in sys.argv
+tasa, muestras_buffer = 44100, 256
+if baja_latencia:
+    # ~6ms de buffer en vez de los ~190 de pygame
+    mixer.pre_init(tasa, -16, 2, muestras_buffer)
 init()
 pantalla = display.set_mode((100, 100))
-sounds = dict((char, mixer.Sound(os.path.join('sounds', fname)))
-              for char, fname in zip(string.ascii_lowercase + string.digits,
-                                     sorted(os.listdir('sounds'))))
+# los sonidos se decodifican en otro thread, o cuando se tocan por
+# primera vez si todavia no llego
+banco = SampleBank('sounds')
+banco.preload()
+sounds = dict(zip(string.ascii_lowercase + string.digits, banco.names))
+if baja_latencia:
+    # 32 voces; si estan todas ocupadas se roba la mas vieja, y cada
+    # sonido corta al anterior del mismo sonido (su grupo de choke)
+    voces = VoiceAllocator(32, steal='oldest')
+    grupos = dict((nombre, nombre) for nombre in banco.names)
+    demoras = []
 
 while True:
-    ev = event.poll()
+    ev = event.wait()                   # sin gastar CPU mientras tanto
     if ev.type in (QUIT, MOUSEBUTTONDOWN):
         break
     elif ev.type == KEYDOWN:
         if ev.unicode in sounds:
-            sounds[ev.unicode].play()
+            if not baja_latencia:
+                banco.get(sounds[ev.unicode]).play()
+                continue
+            antes = ahora()
+            nombre = sounds[ev.unicode]
+            voces.play(banco.get(nombre), grupos[nombre])
+            demoras.append(ahora() - antes)
+
+if baja_latencia and demoras:
+    # esto no es la latencia de verdad: los eventos de pygame no dicen
+    # cuando se apreto la tecla, ni sabemos cuando empieza a sonar el
+    # canal, asi que medimos solo lo que tarda play() y mostramos la
+    # cuenta del buffer del mixer, que es lo minimo que hay que esperar
+    frecuencia, formato, canales = mixer.get_init()
+    buffer_ms = 1000.0 * muestras_buffer / frecuencia
+    demoras.sort()
+    print 'play(): %.2f ms (max %.2f ms), %d golpes, %d voces robadas' % (
+        1000 * demoras[len(demoras)/2], 1000 * demoras[-1], len(demoras),
+        voces.stolen)
+    print 'latencia nominal del buffer del mixer: %d / %d Hz = %.1f ms' % (
+        muestras_buffer, frecuencia, buffer_ms)
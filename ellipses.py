@@ -1,24 +1,36 @@
 #!/usr/bin/python
+# Uso: ellipses.py [cantidad de elipses]
 from pygame import *
 from random import randrange as rand
+import sys
+from sprites import Sprites
 
 pantalla = display.set_mode((0, 0), FULLSCREEN)
 ww, hh = pantalla.get_size()
+cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 20
 
-circles = []
-for ii in range(20):
-    ss = rand(500)
-    surface = Surface((ss, ss), SRCALPHA)
-    draw.ellipse(surface,
-                 Color(rand(256), rand(256), rand(256), 32),
-                 Rect((0, 0), (ss/2, ss/4)))
-    draw.rect(surface, Color(0, 0, 0, 32), surface.get_rect(), 1)
-    circles.append((surface, { 'x': rand(ww),  'y': rand(hh), 'theta': 0 }))
+imagenes, posiciones = [], []
+for ii in range(cantidad):
+    if ii < 20:
+        ss = rand(1, 500)                # rotate se cae con 0x0
+        surface = Surface((ss, ss), SRCALPHA)
+        draw.ellipse(surface,
+                     Color(rand(256), rand(256), rand(256), 32),
+                     Rect((0, 0), (ss/2, ss/4)))
+        draw.rect(surface, Color(0, 0, 0, 32), surface.get_rect(), 1)
+    else:
+        surface = imagenes[rand(20)]
+    imagenes.append(surface)
+    posiciones.append((rand(ww), rand(hh)))
+# 2 grados de 360 por cuadro; las 180 rotaciones de las imagenes que
+# entran en el cache se calculan una vez, en otro thread, empezando
+# por las mas chicas, y las demas en cada cuadro
+circles = Sprites((ww, hh), imagenes, posiciones,
+                  spins=[2] * cantidad, rotations=180)
+circles.cache.prewarm(imagenes[:20])
 
 pantalla.fill(128)
 while event.poll().type not in (QUIT, MOUSEBUTTONDOWN):
-    for surface, estado in circles:
-        pantalla.blit(transform.rotate(surface, estado['theta']),
-                      (estado['x'], estado['y']))
-        estado['theta'] += 2            # 2 grados de 360
+    circles.draw(pantalla)
+    circles.step()
     display.flip()
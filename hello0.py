@@ -1,9 +1,11 @@
 #!/usr/bin/python
 from pygame import *
 from random import randrange
+from pacing import FramePacer
 
 pantalla = display.set_mode((0, 0), FULLSCREEN)
 ww, hh = pantalla.get_size()
+reloj = FramePacer(60)
 
 for xx in range(0, ww, 5):
     draw.line(pantalla,                 # surface
@@ -11,4 +13,5 @@ for xx in range(0, ww, 5):
               (xx, 20),                 # punto de inicio
               (randrange(ww), hh - 20), # punto de terminar
               10)                       # ancho de rayo
-    display.flip()                      # para mostrar
+    if reloj.due(): display.flip()      # para mostrar, 60 veces por segundo
+display.flip()
@@ -14,8 +14,9 @@ http://canonical.org/~kragen/demo/klappquadrat.html
 
 """
 
-import pygame, sys
+import pygame, sys, pacing
 from numpy import zeros, subtract, array, arange, where, take, shape, indices, int64, int32
+from numpy import intp, add, bitwise_and, right_shift, remainder
 
 screensize = (320, 200)
 ncolors = 256
@@ -29,37 +30,83 @@ def clamp(a, b, c):
     d = where(a < b, b, a)
     return where(d < c, d, c)
 
-def redraw(screen, buf, palette, frames):
-    x, y = indices(screensize)
-    # this 256 is not ncolors; it's a timing/pacing thing
-    buf += ((x + frames) & (y + frames)) >> (frames % 256) >> 3
-    buf %= ncolors
-    pygame.surfarray.blit_array(screen, take(palette, buf))
+class Renderer:
+    """The effect's state: the color index of each pixel, plus the x
+    and y coordinate grid and scratch space, allocated once up front.
+
+    Everything is laid out like the screen, a row at a time, which is
+    transposed from surfarray's [x][y]; luckily the pattern is
+    symmetric.  Each frame is done in place with out= ufuncs, so at
+    projector resolutions we don't allocate half a dozen screen-sized
+    temporaries per frame.
+    """
+    def __init__(self, size, ncolors):
+        width, height = size
+        self.ncolors = ncolors
+        self.y, self.x = indices((height, width))
+        self.buf = zeros((height, width), intp) # intp so take needn't convert
+        self.scratch = zeros((height, width), self.x.dtype)
+        self.scratch2 = zeros((height, width), self.x.dtype)
+        self.pixels = None              # colors, in the palette's type
+    def redraw(self, screen, palette, frames, direct=False):
+        a, b, buf = self.scratch, self.scratch2, self.buf
+        # buf += ((x + frames) & (y + frames)) >> (frames % 256) >> 3
+        add(self.x, frames, a)
+        add(self.y, frames, b)
+        bitwise_and(a, b, a)
+        # this 256 is not ncolors; it's a timing/pacing thing
+        right_shift(a, frames % 256, a)
+        right_shift(a, 3, a)
+        add(buf, a, buf)
+        # buf %= ncolors, which is just a mask for powers of two
+        if self.ncolors & (self.ncolors - 1) == 0:
+            bitwise_and(buf, self.ncolors - 1, buf)
+        else:
+            remainder(buf, self.ncolors, buf)
+        if direct:
+            # Look the colors up straight into the locked screen
+            # surface, without allocating or copying a frame; compare
+            # 'klappquadrat.py --pixels2d' with 'klappquadrat.py' in
+            # bench.py.
+            take(palette, buf, out=pygame.surfarray.pixels2d(screen).T,
+                 mode='clip')
+        else:
+            if self.pixels is None or self.pixels.dtype != palette.dtype:
+                self.pixels = zeros(buf.shape, palette.dtype)
+            take(palette, buf, out=self.pixels, mode='clip')
+            pygame.surfarray.blit_array(screen, self.pixels.T)
 
 def main(argv):
     pygame.init()
     screen = pygame.display.set_mode(screensize, pygame.FULLSCREEN)
 
-    buf = zeros(screensize, int32)
+    renderer = Renderer(screensize, ncolors)
     fiery_rgb_integers = clamp(0, subtract.outer(arange(ncolors) + ncolors/8,
                                                  ((array([0, 1, 2]) * ncolors)
                                                   / 4)),
                                ncolors / 4)
     masks = screen.get_masks()[:3]
+    # in the same type as the pixels so we can write them straight in
+    try: pixel_type = pygame.surfarray.pixels2d(screen).dtype
+    except ValueError: pixel_type = int # no pixels2d for 24-bit surfaces
     # I'm not sure this palette is exactly right; it only goes to 63
     # in the original...
     palette = array([colors(masks, levels/float(ncolors/4))
-                     for levels in fiery_rgb_integers])
+                     for levels in fiery_rgb_integers], pixel_type)
+    # pixels2d can't do 24-bit surfaces, so those always use blit_array
+    direct = '--pixels2d' in argv and pixel_type is not int
+    # about 15 fps, skipping frames rather than slowing down if we can't
+    pacer = pacing.FramePacer.from_argv(argv, fps=15, mode='adaptive')
 
     frames = 0
     while 1:
         ev = pygame.event.poll()
         if ev.type == pygame.NOEVENT:
-            frames += 1
-            redraw(screen, buf, palette, frames)
+            frames += pacer.wait()
+            renderer.redraw(screen, palette, frames, direct)
             pygame.display.flip()
-            pygame.time.delay(67)
         elif ev.type == pygame.KEYDOWN: break
         elif ev.type == pygame.QUIT: break
+    print pacer.summary()
 
 if __name__ == '__main__': main(sys.argv)
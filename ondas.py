@@ -28,7 +28,21 @@
 # current time (so you have to take it mod 2*pi) and that you have to
 # manually convert each scalar to a single-precision float.
 
-import pygame, sys, numpy, time, math
+# Projectors are bigger than 256x150, though, and computers have more
+# cores now.  NumPy's ufuncs let go of the GIL while they run, so with
+# --threads=N, World splits its arrays into bands of rows of the
+# screen and computes them on a pool of N threads, all writing into
+# the same output array.  With --native it draws at the
+# screen's own resolution instead of scaling up a thumbnail.
+
+# Modern NumPy also makes the C version's tricks pay off: with
+# --table, World.use_tables replaces the sine, the scaling and the
+# conversion to integers with an integer add, a mask and a table
+# lookup per wave, and that's about 30% faster than the float32 path
+# in bench.py (compare 'ondas.py --table' with 'ondas.py').
+
+import pygame, sys, numpy, time, math, pacing
+from multiprocessing.pool import ThreadPool
 
 twopi = 2 * math.pi
 
@@ -38,16 +52,17 @@ def grayscale_for_masks(masks, level):
 
 class World:
     "The stuff that gets drawn on the screen."
-    def __init__(self, screen):
+    def __init__(self, screen, threads=1):
         self.screen = screen
         width, height = self.screen.get_size()
         # This is a bit hard to explain, but this makes arrays 'xs'
         # and 'ys' that contain the x and y coordinates of each pixel.
         # So every row of the 'xs' array is [0, 1, 2, 3...], and row 0
         # of the 'ys' array is [0, 0, 0, 0...], while row 1 is [1, 1,
-        # 1, 1...].  This is somewhat confused by the default Python
-        # display of these guys being transposed if you print them out.
-        (self.xs, self.ys) = (xs, ys) = numpy.indices((width, height))
+        # 1, 1...].  They're laid out in memory like the screen, a row
+        # at a time, but surfarray indexes pixels as [x][y], so we have
+        # to transpose them (.T) whenever we hand them to surfarray.
+        (self.ys, self.xs) = (ys, xs) = numpy.indices((height, width))
         # Now we want an array of radii (hi Andy).  So we 
         from_center_x = xs - width / 2
         from_center_y = ys - height / 2
@@ -55,41 +70,124 @@ class World:
                         /
                   (width/64)).astype(numpy.float32)
         self.tmp = self.r.copy()  # temp space for later (to reduce per-frame allocation)
+        self.ints = numpy.zeros(self.r.shape, numpy.uint8) # palette indices
 
         masks = self.screen.get_masks()[0:3]
-        # Lookup table for grayscale levels.
+        # Lookup table for grayscale levels, in the same type as the
+        # surface's pixels so that we can write them straight in.
+        try: pixel_type = pygame.surfarray.pixels2d(self.screen).dtype
+        except ValueError: pixel_type = int # no pixels2d for 24-bit surfaces
         self.palette = numpy.array([grayscale_for_masks(masks, level/256.0)
-                                        for level in range(256)])
-    def add_second_wave(self, to_what): pass
+                                        for level in range(256)], pixel_type)
+        self.grayscale = numpy.zeros(self.r.shape, self.palette.dtype)
+        self.direct = False             # write into the surface's pixels?
+        self.can_be_direct = pixel_type is not int
+
+        # Each tile is a band of rows; there are a few per thread so
+        # that a slow thread doesn't hold everyone up.
+        self.pool = ThreadPool(threads) if threads > 1 else None
+        ntiles = threads * 4 if self.pool else 1
+        self.tiles = [slice(ii * height // ntiles,
+                            (ii + 1) * height // ntiles)
+                      for ii in range(ntiles)]
+    def add_second_wave(self, to_what, tile): pass
     def peak(self): return 1.01  # was getting occasional overflow errors on y1
+    def waves(self):
+        "The radius array and relative speed of each wave."
+        return [(self.r, 1)]
+    bits = 12                           # log2 of the sine table size
+    def use_tables(self):
+        """Switch to integer phases and table lookups instead of floats.
+
+        Each wave's phase at each pixel, in units of 1/4096 of a cycle,
+        is computed once here; each frame we just add the current time
+        to it, mask it, and look the result up in a table.  With one
+        wave the table goes straight from phase to pixel value.  With
+        more, each wave's table gives its height in eighths of a
+        grayscale level, already offset to be positive, and the sum
+        indexes a palette with each color repeated eight times.
+        """
+        N = 1 << self.bits
+        self.phases = [(numpy.round(r * (N / twopi)).astype(numpy.intp)
+                        & (N - 1), speed)
+                       for r, speed in self.waves()]
+        self.idx = numpy.zeros(self.r.shape, numpy.intp)
+        sines = numpy.sin(numpy.arange(N) * (twopi / N))
+        scale = 256 / (self.peak()*2)
+        if len(self.phases) == 1:
+            levels = ((sines + self.peak()) * scale).astype(numpy.uint8)
+            self.tables = [self.palette[levels]]
+        else:
+            self.tables = [numpy.round(sines * scale * 8).astype(numpy.intp)
+                           for phase in self.phases]
+            self.tables[0] += 128 * 8
+            self.fine_palette = numpy.repeat(self.palette, 8)
+            self.acc = numpy.zeros(self.r.shape, numpy.intp)
+            self.wave = numpy.zeros(self.r.shape, numpy.intp)
+        self.render = self.render_tables
+    def render_tables(self, tile):
+        "Compute the pixels for a band of rows with the tables."
+        N = numpy
+        size = 1 << self.bits
+        idx = self.idx[tile]
+        for ii, (phase, speed) in enumerate(self.phases):
+            # idx gets the phase of sin(r - time) for each pixel
+            N.add(phase[tile], int(-self.now * speed % twopi * size / twopi),
+                  idx)
+            N.bitwise_and(idx, size - 1, idx)
+            if len(self.phases) == 1:
+                N.take(self.tables[0], idx, out=self.grayscale[tile],
+                       mode='clip')
+            elif ii == 0:
+                N.take(self.tables[0], idx, out=self.acc[tile], mode='clip')
+            else:
+                N.take(self.tables[ii], idx, out=self.wave[tile], mode='clip')
+                N.add(self.acc[tile], self.wave[tile], self.acc[tile])
+        if len(self.phases) > 1:
+            N.take(self.fine_palette, self.acc[tile],
+                   out=self.grayscale[tile], mode='clip')
     def redraw(self):
+        self.now = time.time()          # the same for every tile
+        # In 2007 I tried using surfarray.pixels2d and blitting from
+        # there, but that made things like 10% slower, so normally we
+        # blit_array onto the screen.  With --pixels2d, though, we
+        # lock the surface and have take() write the pixels straight
+        # into it, which saves allocating and copying a whole frame;
+        # compare 'ondas.py --pixels2d' with 'ondas.py' in bench.py.
+        if self.direct:
+            self.grayscale = pygame.surfarray.pixels2d(self.screen).T
+        if self.pool: self.pool.map(self.render, self.tiles)
+        else: self.render(self.tiles[0])
+        if self.direct: self.grayscale = None # unlocks the surface
+        else: pygame.surfarray.blit_array(self.screen, self.grayscale.T)
+    def render(self, tile):
+        "Compute the grayscale pixels for a band of rows."
         # This function is written in a fairly assembly-language style
         # in order to cut down on the number of intermediate result
         # spaces that must be allocated.
-        tmp = self.tmp                  # to make code briefer
+        tmp = self.tmp[tile]            # to make code briefer
         N = numpy
         f32 = lambda x: N.array(x, N.float32)
         # tmp gets -time.time() + self.r
-        N.add(f32(-time.time() % twopi), self.r, tmp)
+        N.add(f32(-self.now % twopi), self.r[tile], tmp)
         # tmp gets sin(tmp), i.e. sin(r - time)
         N.sin(tmp, tmp)
-        self.add_second_wave(tmp)  # add a second wave in the subclass
+        self.add_second_wave(tmp, tile)  # add a second wave in the subclass
         # tmp gets tmp + peak, i.e. peak + sin(r - time)
         N.add(tmp, f32(self.peak()), tmp)
         # tmp gets tmp * (256/ (2*peak)), i.e. (1 + sin(r-time))/2 * 256
         N.multiply(tmp, f32(256 / (self.peak()*2)), tmp)
-        # round floats to Int8 so we can look things up in palette
-        ints = tmp.astype(N.int8)
-        # Look up the pixel value for each grayscale level in the palette
-        grayscale = N.take(self.palette, ints)
-        # I tried using surfarray.pixels2d and blitting from there,
-        # but that made things like 10% slower.  So here we blit_array
-        # onto the screen.
-        pygame.surfarray.blit_array(self.screen, grayscale)
+        # round floats to bytes so we can look things up in palette
+        ints = self.ints[tile]
+        ints[...] = tmp
+        # Look up the pixel value for each grayscale level in the
+        # palette.  The indices can't be out of range, and saying so
+        # with mode='clip' keeps take from buffering its output.
+        N.take(self.palette, ints, out=self.grayscale[tile], mode='clip')
 
 class World2Waves(World):
-    def __init__(self, screen):
-        World.__init__(self, screen)
+    def __init__(self, screen, threads=1):
+        World.__init__(self, screen, threads)
         # Center our second set of waves at the upper left-hand corner
         # of the screen instead of the middle, and give it twice as
         # long a wavelength
@@ -97,34 +195,48 @@ class World2Waves(World):
                               /
                    (screen.get_width()/32)).astype(numpy.float32)
         self.tmp2 = self.r.copy()
-    def add_second_wave(self, to_what):
+    def add_second_wave(self, to_what, tile):
         # our second wave travels slower by a factor of e
-        numpy.add(numpy.array(-time.time() / numpy.e % twopi,
+        tmp2 = self.tmp2[tile]
+        numpy.add(numpy.array(-self.now / numpy.e % twopi,
                               numpy.float32),
-                    self.r2, self.tmp2)
-        numpy.sin(self.tmp2, self.tmp2)
-        numpy.add(self.tmp2, to_what, to_what)
+                    self.r2[tile], tmp2)
+        numpy.sin(tmp2, tmp2)
+        numpy.add(tmp2, to_what, to_what)
     def peak(self): return 2
+    def waves(self): return World.waves(self) + [(self.r2, 1 / numpy.e)]
 
 def main(argv):
+    threads = 1
+    for arg in argv[1:]:
+        if arg.startswith('--threads='): threads = int(arg[len('--threads='):])
+    native = '--native' in argv
+
     pygame.init()
     screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
     pygame.mouse.set_visible(False)
 
-    buf = pygame.Surface((256, 150))
-    world = World2Waves(buf)  # alternatively just World(screen)
+    buf = screen if native else pygame.Surface((256, 150))
+    world = World2Waves(buf, threads)  # alternatively just World(screen)
+    if '--table' in argv: world.use_tables()
+    world.direct = '--pixels2d' in argv and world.can_be_direct
+    # the waves move with the clock, so frames can come whenever
+    pacer = pacing.FramePacer.from_argv(argv, fps=60)
     frames = 0
     start = time.time()
     while 1:
         ev = pygame.event.poll()
         if ev.type == pygame.NOEVENT:
+            pacer.wait()
             frames += 1
             world.redraw()
-            pygame.transform.smoothscale(buf, screen.get_size(), screen)
+            if not native:
+                pygame.transform.smoothscale(buf, screen.get_size(), screen)
             pygame.display.flip()
         elif ev.type == pygame.MOUSEBUTTONDOWN: break
         elif ev.type == pygame.QUIT: break
     end = time.time()
     print "%.2f seconds, %.2f fps" % ((end - start), frames / (end - start))
+    print pacer.summary()
 
 if __name__ == '__main__': main(sys.argv)
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+"""Streaming additive synthesis: a bank of sine oscillators.
+
+sintesis1.py and sintesis2.py compute a whole looping buffer for each
+sound, so changing the pitch means computing a new buffer and
+crossfading to it, and you can hear the seam.  An OscillatorBank
+instead computes short blocks of samples, a few milliseconds each, as
+they are needed, and queues them one after another on a mixer
+Channel.  Each oscillator keeps its phase from one block to the next,
+so changing its frequency never makes the wave jump, and amplitude
+changes are ramped across a block so they don't click either.  Any
+change takes effect at the start of the next block computed.
+
+The blocks are a few Sounds made once at the start and overwritten in
+turn through sndarray.samples, and all the NumPy work happens in
+arrays that are also allocated at the start, so nothing is allocated
+while it plays.
+
+A Channel only holds one Sound queued after the one playing, so a
+block has to last at least as long as one of the mixer's buffers, or
+the mixer runs out of queued sound within a single buffer and plays
+silence.  mixer.get_init doesn't tell us the buffer size, so pass
+the one you gave mixer.pre_init; blocks are that size by default.
+The latency is one or two blocks plus the mixer's own buffer, so you
+probably want to give mixer.pre_init a small buffer size.
+"""
+import pygame, numpy, threading, time
+
+class OscillatorBank(threading.Thread):
+    """noscillators sine oscillators, all silent at first, played in
+    blocks of blocksize samples in their own thread.  buffer is the
+    mixer's buffer size, in samples; blocksize defaults to it and
+    can't be smaller.
+
+    The mixer has to be initialized (to 16-bit samples) before you
+    create one.  Call start() to start playing, set() to change the
+    oscillators, and stop() to silence them.
+    """
+    nsounds = 4               # playing, queued, being filled, and spare
+    def __init__(self, noscillators, blocksize=None, channel=None,
+                 buffer=4096):
+        threading.Thread.__init__(self, name='OscillatorBank')
+        self.daemon = True
+        self.rate, format, channels = pygame.mixer.get_init()
+        self.blocksize = blocksize = max(blocksize or buffer, buffer)
+        self.channel = channel or pygame.mixer.find_channel(True)
+        shape = (blocksize, channels) if channels > 1 else (blocksize,)
+        self.sounds = [pygame.sndarray.make_sound(numpy.zeros(shape,
+                                                              numpy.int16))
+                       for ii in range(self.nsounds)]
+        self.buffers = [pygame.sndarray.samples(sound)
+                        for sound in self.sounds]
+        self.next_sound = 0
+
+        # what set() asks for, and what the last block ended with
+        self.frequencies = numpy.zeros(noscillators)
+        self.amplitudes = numpy.zeros(noscillators)
+        self.current_amplitudes = numpy.zeros(noscillators)
+        self.phases = numpy.zeros(noscillators)
+
+        self.ticks = numpy.arange(1, blocksize + 1, dtype=float)
+        self.ramp = self.ticks / blocksize
+        self.increments = numpy.zeros(noscillators)
+        self.steps = numpy.zeros(noscillators)
+        self.waves = numpy.zeros((noscillators, blocksize))
+        self.envelopes = numpy.zeros((noscillators, blocksize))
+        self.mix = numpy.zeros(blocksize)
+        self.running = True
+
+    def set(self, oscillator, hz=None, amplitude=None):
+        """Change an oscillator's frequency and peak amplitude (in
+        sample units, up to 32767 for all of them together)."""
+        if hz is not None: self.frequencies[oscillator] = hz
+        if amplitude is not None: self.amplitudes[oscillator] = amplitude
+
+    def fill(self, samples):
+        "Compute the next block into samples, an array from a Sound."
+        increments, waves = self.increments, self.waves
+        envelopes = self.envelopes
+        numpy.multiply(self.frequencies, 2 * numpy.pi / self.rate, increments)
+        numpy.multiply(increments[:, None], self.ticks, waves)
+        waves += self.phases[:, None]
+        numpy.sin(waves, waves)
+        numpy.subtract(self.amplitudes, self.current_amplitudes, self.steps)
+        numpy.multiply(self.steps[:, None], self.ramp, envelopes)
+        envelopes += self.current_amplitudes[:, None]
+        waves *= envelopes
+        waves.sum(axis=0, out=self.mix)
+        numpy.clip(self.mix, -32767, 32767, self.mix)
+        if samples.ndim > 1: samples[...] = self.mix[:, None]
+        else: samples[...] = self.mix
+
+        self.current_amplitudes[...] = envelopes[:, -1]
+        numpy.multiply(increments, self.blocksize, self.steps)
+        self.phases += self.steps
+        numpy.remainder(self.phases, 2 * numpy.pi, self.phases)
+
+    def next_block(self):
+        sound = self.sounds[self.next_sound]
+        self.fill(self.buffers[self.next_sound])
+        self.next_sound = (self.next_sound + 1) % self.nsounds
+        return sound
+
+    def run(self):
+        period = self.blocksize / float(self.rate) / 4
+        self.channel.play(self.next_block())
+        while self.running:
+            if self.channel.get_queue() is None:
+                self.channel.queue(self.next_block())
+            time.sleep(period)
+
+    def stop(self):
+        self.running = False
+        if self.is_alive(): self.join()
+        self.channel.stop()
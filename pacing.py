@@ -0,0 +1,135 @@
+#!/usr/bin/python
+"""Frame pacing for the demos.
+
+Left to themselves, the demos draw frames as fast as they can, which
+keeps a core busy at 100% to redraw things nobody can see change that
+fast, or sleep a fixed time per frame, which runs slow whenever
+drawing takes a while.  A FramePacer decides when the next frame
+should start, in one of these modes:
+
+- 'free': right away, as before;
+- 'target': at a steady fps, sleeping until each frame's deadline,
+  and catching up if a frame runs late;
+- 'adaptive': like target, but when drawing can't keep up it skips
+  the deadlines it missed instead of trying to catch up, and tells
+  you how many frame periods went by, so you can advance the
+  animation that much further;
+- 'idle': like target while something is animating, but when nothing
+  is, it blocks until there's input, so an installation sitting still
+  uses no CPU at all.
+
+It also keeps the last few hundred frame times, for summary().
+
+    pacer = FramePacer.from_argv(sys.argv, fps=30, mode='adaptive')
+    while True:
+        steps = pacer.wait()
+        ...handle events, advance the animation by steps, draw...
+
+The sleeping is done with pygame.time.wait, which has millisecond
+precision, and which bench.py turns off, so that benchmarks still
+measure how fast a demo can draw.
+"""
+import pygame, time, collections
+
+WAKE = pygame.USEREVENT                 # posted by wake() to end an idle wait
+
+class FramePacer:
+    modes = 'free', 'target', 'adaptive', 'idle'
+    max_lag = 1.0                       # seconds behind before giving up
+    def __init__(self, fps=60, mode='target', keep=600):
+        if mode not in self.modes: raise ValueError("no pacing mode %r" % mode)
+        self.period, self.mode = 1.0 / fps, mode
+        self.deadline = None            # when the next frame should start
+        self.last = None                # when the last frame started
+        self.intervals = collections.deque(maxlen=keep) # start to start
+        self.busy = collections.deque(maxlen=keep) # start to next wait()
+        self.skipped = self.idles = 0
+        self.idle_time = 0.0
+
+    @classmethod
+    def from_argv(cls, argv, fps=60, mode='target'):
+        "A pacer with defaults overridden by --fps=N and --pacing=MODE."
+        for arg in argv[1:]:
+            if arg.startswith('--fps='): fps = float(arg[len('--fps='):])
+            elif arg.startswith('--pacing='): mode = arg[len('--pacing='):]
+        return cls(fps, mode)
+
+    def wait(self, animating=True):
+        """Wait until it's time to start the next frame.
+
+        Returns how many frame periods have gone by since the last
+        frame, which is more than 1 only in adaptive mode when frames
+        were skipped.  In idle mode, pass animating=False when nothing
+        will change until there's some input.
+        """
+        now = time.time()
+        if self.last is not None: self.busy.append(now - self.last)
+        steps = 1
+        if self.mode == 'idle' and not animating:
+            self.idle()
+            self.deadline = self.last = None
+        elif self.mode != 'free':
+            if self.deadline is None or now - self.deadline > self.max_lag:
+                self.deadline = now
+            else:
+                self.deadline += self.period
+            late = int((now - self.deadline) / self.period)
+            if self.mode == 'adaptive' and late > 0:
+                self.deadline += late * self.period
+                self.skipped += late
+                steps += late
+            self.sleep_until(self.deadline)
+        now = time.time()
+        if self.last is not None: self.intervals.append(now - self.last)
+        self.last = now
+        return steps
+
+    def due(self):
+        """Whether a frame is due, without waiting; for loops that do a
+        little work at a time and only want to show it now and then."""
+        now = time.time()
+        if self.deadline is not None and now < self.deadline: return False
+        self.deadline = now + self.period
+        if self.last is not None: self.intervals.append(now - self.last)
+        self.last = now
+        return True
+
+    def sleep_until(self, deadline):
+        ms = int((deadline - time.time()) * 1000)
+        if ms > 0: pygame.time.wait(ms)
+
+    def idle(self):
+        "Block until there's an event, and put it back for the caller."
+        start = time.time()
+        ev = pygame.event.wait()
+        if ev.type != WAKE: pygame.event.post(ev)
+        self.idles += 1
+        self.idle_time += time.time() - start
+
+    def wake(self):
+        """End an idle wait, or the next one if we're not in one yet;
+        can be called from any thread.
+
+        It always posts a WAKE event: the caller may have just decided
+        nothing is animating and be about to wait, and idle() throws
+        the WAKE away anyway, while other loops ignore it."""
+        try: pygame.event.post(pygame.event.Event(WAKE))
+        except pygame.error: pass       # the queue is full, which wakes it
+
+    def summary(self):
+        "A line of text describing the recent frame times."
+        p50, p95, p99 = percentiles(self.intervals)
+        busy = percentiles(self.busy, (50,))[0]
+        return ("%s %g fps: %d frames, p50 %.1f ms, p95 %.1f ms, "
+                "p99 %.1f ms, busy p50 %.1f ms, %d skipped, "
+                "%d idle waits (%.1f s)"
+                % (self.mode, 1 / self.period, len(self.intervals),
+                   p50 * 1000, p95 * 1000, p99 * 1000, busy * 1000,
+                   self.skipped, self.idles, self.idle_time))
+
+def percentiles(times, percents=(50, 95, 99)):
+    "The given percentiles of some times, by nearest rank."
+    times = sorted(times)
+    if not times: return [0 for percent in percents]
+    return [times[min(len(times) - 1, int(len(times) * percent / 100.0))]
+            for percent in percents]
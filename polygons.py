@@ -4,13 +4,15 @@
 # lo cual es inspirado por Pedal (1995), por Dave Moore
 from pygame import *
 from math import pi, sin, cos
+from pacing import FramePacer
 
 pantalla = display.set_mode((0, 0), FULLSCREEN)
 ww, hh = pantalla.get_size()
 theta, d_theta, r, color = 0, 0.04, hh/2, (255, 64, 64)
+reloj = FramePacer(60, 'adaptive')
 
 while event.poll().type not in (MOUSEBUTTONDOWN, QUIT):
-    theta += d_theta
+    theta += d_theta * reloj.wait()
 
     puntos = [(ww/2 + sin(ii * theta) * r, # x
                hh/2 - cos(ii * theta) * r) # y
@@ -20,4 +22,3 @@ while event.poll().type not in (MOUSEBUTTONDOWN, QUIT):
     draw.polygon(pantalla, color, puntos)
 
     display.flip()
-    time.delay(15)
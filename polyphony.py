@@ -0,0 +1,71 @@
+#!/usr/bin/python
+"""Voice allocation for playing lots of short sounds on the mixer.
+
+Sound.play picks a free mixer channel, and if there isn't one the hit
+is silently lost, which is what happens on a fast drum roll with the
+default eight channels.  A VoiceAllocator owns all the mixer's
+channels and, when every one of them is busy, steals one: the one
+that started longest ago, or the one that is probably quietest by now.
+
+It also does choke groups, like a drum machine: playing a sound in a
+group first cuts off whatever else is still sounding in the same
+group, the way closing a hi-hat cuts off the open hi-hat.
+"""
+import pygame, time
+
+class VoiceAllocator:
+    """Plays Sounds on nvoices mixer channels.
+
+    steal is 'oldest' or 'quietest'.  We can't ask the mixer how loud
+    a channel is right now, so 'quietest' guesses, assuming that
+    samples die away: the channel's volume times the fraction of its
+    sound that's left to play.
+    """
+    def __init__(self, nvoices=32, steal='oldest', choke_ms=5):
+        pygame.mixer.set_num_channels(nvoices)
+        self.channels = [pygame.mixer.Channel(ii) for ii in range(nvoices)]
+        self.started = [0.0] * nvoices
+        self.lengths = [0.0] * nvoices
+        self.groups = [None] * nvoices
+        self.steal, self.choke_ms = steal, choke_ms
+        self.stolen = 0
+
+    def play(self, sound, group=None, volume=1.0):
+        """Play sound, choking anything else in group (if not None),
+        and return the Channel it's playing on."""
+        now = time.time()
+        if group is not None: self.choke(group)
+        voice = self.free_voice()
+        if voice is None:
+            voice = self.victim(now)
+            self.stolen += 1
+        channel = self.channels[voice]
+        channel.set_volume(volume)
+        channel.play(sound)
+        self.started[voice], self.lengths[voice] = now, sound.get_length()
+        self.groups[voice] = group
+        return channel
+
+    def choke(self, group):
+        "Fade out, very quickly, everything playing in group."
+        for voice, channel in enumerate(self.channels):
+            if self.groups[voice] == group:
+                if channel.get_busy(): channel.fadeout(self.choke_ms)
+                self.groups[voice] = None
+
+    def free_voice(self):
+        for voice, channel in enumerate(self.channels):
+            if not channel.get_busy(): return voice
+        return None
+
+    def victim(self, now):
+        "The busy voice to steal."
+        voices = range(len(self.channels))
+        if self.steal == 'quietest':
+            return min(voices, key=lambda voice: self.loudness(voice, now))
+        return min(voices, key=self.started.__getitem__)
+
+    def loudness(self, voice, now):
+        if not self.lengths[voice]: return 0
+        left = 1 - (now - self.started[voice]) / self.lengths[voice]
+        return self.channels[voice].get_volume() * max(0, left)
@@ -4,6 +4,13 @@
 2007-12-07, 08, 09, 10, 11, and 12.
 
 Drag things around with the mouse; the right mouse button exits.
+Run with --dirty to repaint only the parts of the screen that change,
+or with --bounce out.wav [--cycles N] to render N cycles of the
+arrangement to a WAV file, faster than real time, instead of playing.
+S saves the arrangement to pygmusic-world.npz, L reloads it, and
+--load file.npz starts from a saved arrangement.  It draws at most
+--fps=60 frames a second, and none while nothing moves; --pacing=free
+draws as fast as it can, as it used to.
 
 I, the copyright holder of this work, hereby release it into the
 public domain. This applies worldwide.
@@ -13,7 +20,9 @@ to use this work for any purpose, without any conditions, unless
 such conditions are required by law.
 """
 
-import pygame, time, os, sys, math
+import pygame, time, os, sys, math, threading, heapq, collections, json, signal
+import copy, wave, itertools
+import samplebank, pacing
 
 ### basic utility functions
 
@@ -33,9 +42,30 @@ def pscale((x, y), factor):
     "Scale an offset between two 2-D points by a fraction."
     return (x * factor, y * factor)
 
+class FreeList:
+    """Objects that are done with, kept by key to be used again.
+
+    Halos and lines come and go many times a second; picking up an old
+    one, Surface and all, is cheaper than making a new one.  It keeps
+    at most 'limit' of them altogether.
+    """
+    def __init__(self, limit=64):
+        self.free = collections.defaultdict(list)
+        self.count, self.limit = 0, limit
+    def get(self, key):
+        "Return a recycled object for key, or None."
+        free = self.free.get(key)
+        if not free: return None
+        self.count -= 1
+        return free.pop()
+    def put(self, key, obj):
+        if self.count >= self.limit: return
+        self.free[key].append(obj)
+        self.count += 1
+
 ### basic drawable objects
 
-class Visible:
+class Visible(object):
     """Things that get drawn on the screen and maybe handle mouse clicks
     or make sounds.
 
@@ -44,10 +74,23 @@ class Visible:
     - obj.contains((x, y)): tell whether a mouse position is in the object
     - obj.handle_click(world, event): handle a mouse button going down
     - obj.play(world): make any appropriate sounds
+    - obj.hit(world, when): make any appropriate sounds, scheduled for
+      time 'when' by the AudioScheduler; this is called from the
+      scheduler's thread, so anything visual has to go through
+      world.defer
     - obj.center(): return (x, y) center to decide when to be played
-    - obj.draw(self, world, screen): display itself; called every frame.
+    - obj.advance(world): bring any animation up to the current time,
+      returning a list of the screen rects that now look different;
+      called once every frame, before anything is drawn.
+    - obj.draw(self, world, screen): display itself; called every frame,
+      or in incremental mode, once for every changed area it overlaps,
+      with the screen clipped to that area.
     - obj.is_drop_target_for(self, object, world): handle object being
       dropped on us
+    - obj.lifetime: seconds after which world.add_nonclickable deletes
+      it, or None to keep it until someone else does
+    - obj.recycle(): it's been deleted from the nonclickable objects,
+      so it can be reused
 
     Additionally, if an object is draggable, it needs to support these:
     - obj.move(delta): move by delta x and delta y
@@ -58,11 +101,18 @@ class Visible:
     pygame.Rect.
 
     """
+    __slots__ = ()                      # so that subclasses can have them
+    lifetime = None
     def contains(self, (x, y)): return self.rect.collidepoint(x, y)
     def center(self): return self.rect.center
     def is_drop_target_for(self, obj, world): "Default is to do nothing."
     def handle_click(self, world, ev): "Default is to do nothing."
     def play(self, world): "Default is to do nothing."
+    def hit(self, world, when): "Default is to do nothing."
+    def advance(self, world):
+        "Default is to stay the same."
+        return []
+    def recycle(self): "Default is to let it be garbage-collected."
 
 class Timer(Visible):
     "A horizontal strip on the screen that plays things in it when triggered."
@@ -75,6 +125,10 @@ class Timer(Visible):
         self.start = time.time()
         self.lastoffset = 0
         self.divisions = divisions
+        self.cursor = []                # rects for the current cursor
+        # Triggers restart us from the AudioScheduler's thread, so
+        # start and lastoffset change together under this lock.
+        self.lock = threading.Lock()
     def drawvbar(self, screen, offset, color):
         "Draws a timing mark at a given offset."
         screen.fill(color, ((self.rect.left + offset, self.rect.top),
@@ -88,7 +142,13 @@ class Timer(Visible):
         self.drawvbars(screen, self.divisions*2, gray(136))
         self.drawvbars(screen, self.divisions, gray(144))
         self.drawvbars(screen, 2, gray(192))
-        if self.active: self.draw_cursor(world, screen)
+        self.draw_cursor(world, screen)
+    def advance(self, world):
+        "Moves the cursor, which repaints both where it was and where it is."
+        damage = self.cursor
+        with self.lock:
+            self.cursor = self.advance_cursor(world) if self.active else []
+        return damage + self.cursor
     def time(self):
         "The time since the beginning of the current play cycle."
         age = time.time() - self.start
@@ -98,11 +158,26 @@ class Timer(Visible):
         "The current position of the cursor for this timer."
         return int(self.time() / self.cycletime * self.rect.w + 0.5)
     def handle_click(self, world, ev): self.trigger()
-    def trigger(self):
-        "Start playing the sounds within."
-        self.active = True
-        self.lastoffset = 0
-        self.start = time.time()
+    def trigger(self, when=None):
+        "Start playing the sounds within, as of 'when' (default now)."
+        with self.lock:
+            self.active = True
+            self.lastoffset = 0
+            self.start = time.time() if when is None else when
+    def phase(self, obj):
+        """The fraction of a cycle after which an object in us gets played.
+
+        This is the moment the drawn cursor first covers its center.
+        """
+        return (obj.center()[0] - self.rect.left + 0.5) / float(self.rect.w)
+    def hits(self, world, t0, t1):
+        "Return (time, object) for everything we play between t0 and t1."
+        if not self.active: return []
+        rv = []
+        for obj in world.objects_in(self.rect):
+            when = self.start + self.phase(obj) * self.cycletime
+            if obj is not self and t0 <= when < t1: rv.append((when, obj))
+        return rv
     def triggerpoint(self):
         return self.rect.midleft
     def cursor_rect(self, start, end):
@@ -112,19 +187,26 @@ class Timer(Visible):
     def cursor_rects(self, offset):
         "Returns the Rects showing the currently playing period on the screen."
         assert offset >= self.lastoffset
+        if self.lastoffset == offset == self.rect.w: return [] # all done
         return [self.cursor_rect(self.lastoffset, offset)]
     def draw_cursor(self, world, screen):
-        """Draws the white box that represents the currently playing period,
-        and also plays the sounds found within."""
+        "Draws the white box that represents the currently playing period."
+        for rect in self.cursor: screen.fill(white, rect)
+    def advance_cursor(self, world):
+        """Returns the rects of the currently playing period, and also
+        plays the sounds found within if nobody else is doing that."""
         offset = self.offset()
-        for rect in self.cursor_rects(offset):
-            screen.fill(white, rect)
+        rects = self.cursor_rects(offset)
+        for rect in rects:
+            # Normally the AudioScheduler plays things on time and
+            # this is only a picture.
+            if world.audio is not None: continue
             # If we .play() things immediately, there could be
             # surprising effects (e.g. if we're playing ourselves).
             # So we enqueue the playing for later.
-            for obj in world.objects_in(rect):
-                world.defer(lambda obj=obj: obj.play(world))
+            for obj in world.objects_in(rect): world.defer(obj.play, world)
         self.lastoffset = offset
+        return rects
 
 class RepeatingTimer(Timer):
     "A horizontal strip on the screen that plays things in it repeatedly."
@@ -132,8 +214,24 @@ class RepeatingTimer(Timer):
         return (time.time() - self.start) % self.cycletime
     def handle_click(self, world, ev):
         "Turns the timer on and off when clicked."
-        if not self.active: self.lastoffset = self.offset()
-        self.active = not self.active
+        with self.lock:
+            if not self.active: self.lastoffset = self.offset()
+            self.active = not self.active
+    def hits(self, world, t0, t1):
+        if not self.active: return []
+        rv = []
+        for obj in world.objects_in(self.rect):
+            if obj is self: continue
+            phase = self.phase(obj)
+            # the first cycle number n with start + (n + phase) * cycletime
+            # at or after t0
+            n = math.ceil((t0 - self.start) / self.cycletime - phase)
+            when = self.start + (n + phase) * self.cycletime
+            while when < t1:
+                rv.append((when, obj))
+                n += 1
+                when = self.start + (n + phase) * self.cycletime
+        return rv
     def cursor_rects(self, offset):
         if offset >= self.lastoffset:
             return [self.cursor_rect(self.lastoffset, offset)]
@@ -143,6 +241,7 @@ class RepeatingTimer(Timer):
 
 class ImageDisplay(Visible):
     "A visible object that displays by merely blitting an image."
+    __slots__ = 'image', 'rect'
     def __init__(self, pos, image):
         self.image = image
         self.rect = pygame.Rect(pos, image.get_size()) # to satisfy Visible
@@ -153,6 +252,9 @@ class ImageDisplay(Visible):
 class UglyHalo(ImageDisplay):
     """A white square that fades to nothing over 0.6 seconds to show
     that something has happened."""
+    __slots__ = 'start',
+    lifetime = 0.6
+    pool = FreeList()                   # by halo size
     def __init__(self, rect):
         "rect is the area to draw the halo around."
         halosize = rect.h * 2
@@ -161,121 +263,169 @@ class UglyHalo(ImageDisplay):
         # figured that fading the per-pixel alpha in a Python nested loop
         # would be too slow, so for now, it's a white square.  See the
         # NumericHalo class for an alternative.
-        image = pygame.surface.Surface((halosize, halosize))
-        image.fill(white)
-        ImageDisplay.__init__(self, pdiff(image.get_rect().center, rect.center),
-                              image)
+        self.image = pygame.surface.Surface((halosize, halosize))
+        self.image.fill(white)
+        self.place(rect)
+    @classmethod
+    def make(cls, rect):
+        "A halo around rect, recycled if there's one the right size."
+        halo = cls.pool.get(rect.h * 2)
+        if halo is None: return cls(rect)
+        halo.place(rect)
+        return halo
+    def place(self, rect):
+        "Start over, around rect."
+        self.rect = self.image.get_rect(center=rect.center)
         self.start = time.time()
-    def draw(self, world, surface):
-        "Blits the halo image with the current opacity; possibly suicides."
+    def recycle(self): self.pool.put(self.image.get_height(), self)
+    def advance(self, world):
+        "Sets the halo image to the current opacity."
         age = time.time() - self.start
-        opacity = int(255 * (0.6 - age))
-        if opacity <= 0: world.delete(self)
-        else:
-            self.image.set_alpha(opacity)
-            ImageDisplay.draw(self, world, surface)
-
-### rendering haloes with Numeric
-
-def scale(mask, component):
-    "Encode a floating-point color component in [0, 1] with a bitmask."
-    assert 0 <= component <= 1, component
-    mask = mask % (2**32)               # make unsigned
-    rv = int(mask * component) & mask   # scale mask by weight
-    if rv >= 2**31: rv -= 2**32         # convert back to signed
-    rv = int(rv)                        # convert back to non-long
-    return rv
+        self.image.set_alpha(max(0, int(255 * (self.lifetime - age))))
+        return [self.rect]
+
+### rendering haloes with NumPy
 
-def pixel(masks, components):
-    "Encode an (r, g, b, alpha) tuple according to given masks."
-    return sum(map(scale, masks, components))
+def pixels(masks, components):
+    """Encode (r, g, b, alpha) components according to given masks.
+
+    The components are floating-point numbers or arrays in [0, 1], and
+    the result is an array of unsigned 32-bit pixel values.
+    """
+    rv = 0
+    for mask, component in zip(masks, components):
+        mask = numpy.uint32(mask % 2**32)   # make unsigned
+        rv = rv | (numpy.asarray(component) * float(mask)
+                   ).astype(numpy.uint32) & mask
+    return rv
 
 class NumericHaloMovie:
-    "Renders frames of a halo on demand, then caches them."
+    """Renders all the frames of a halo at once into a single surface,
+    and hands out pieces of it.
+
+    The frames are stacked one above the other rather than side by
+    side because SDL limits the number of bytes in a row of pixels.
+    """
     def __init__(self, args):
         framelength, size, max_age, fuzz = args
         self.framelength = framelength
         self.size = size                # size of the object halo is around
         self.max_age = max_age
         self.fuzzsq = fuzz**2
-        self.frames = {}
         self.shape = (size*2, size*2)
-        cx = cy = size                  # x and y at center
-        xs, ys = Numeric.indices(self.shape) # x and y coords of each pixel
+        self.nframes = int(max_age / framelength + 0.5) + 1
+        self.atlas = self.render()
+        width, height = self.shape
+        self.frames = [self.atlas.subsurface(((0, ii * height), self.shape))
+                       for ii in range(self.nframes)]
+    def render(self):
+        "Render every frame of the movie into one tall surface."
+        width, height = self.shape
+        cx = cy = self.size             # x and y at center
+        xs, ys = numpy.indices(self.shape) # x and y coords of each pixel
         (dx, dy) = (xs - cx, ys - cy)   # distances from center for each pixel
-        self.rsq = dx*dx + dy*dy        # squared distance from center
-    def render_frame(self, framenum):
-        age = framenum * self.framelength # age in seconds to show this frame at
+        rsq = dx*dx + dy*dy             # squared distance from center
+        # age in seconds to show each frame at
+        ages = numpy.arange(self.nframes) * self.framelength
         # create a surface that has an alpha channel, to render to and return
-        mysurf = pygame.Surface(self.shape).convert_alpha()
-        masks = mysurf.get_masks()      # get bitmasks for r, g, b, alpha
-        global_alpha = (self.max_age**2 - age**2)/self.max_age**2
+        atlas = pygame.Surface((width, height * self.nframes)).convert_alpha()
+        masks = atlas.get_masks()       # get bitmasks for r, g, b, alpha
+        global_alpha = numpy.clip((self.max_age**2 - ages**2)/self.max_age**2,
+                                  0, 1)
         fsq = self.fuzzsq
-        # palette is the colors in delta-rsquared, from densest to
-        # most rarefied.  Most rarefied is transparent, 0.  Densest is
-        # nearly white.
-        palette = Numeric.array(
-            [pixel(masks, (1, 1,        # r and g are always 100%
-                           0.8 * float(fsq-ii)/fsq, # b is 0-80%
-                           0.9 * float(fsq-ii)/fsq * global_alpha))
-             for ii in range(fsq)] + [0])
+        # palettes[ii] is the colors in delta-rsquared for frame ii,
+        # from densest to most rarefied.  Most rarefied is transparent,
+        # 0.  Densest is nearly white.
+        levels = (fsq - numpy.arange(fsq)) / float(fsq)
+        palettes = numpy.zeros((self.nframes, fsq + 1), numpy.uint32)
+        palettes[:, :fsq] = pixels(masks, (1, 1, # r and g are always 100%
+                                           0.8 * levels, # b is 0-80%
+                                           0.9 * numpy.outer(global_alpha,
+                                                             levels)))
         # This is the r-squared where that maximum density is found.
         # The formula is just voodoo --- I whacked on it until the
         # effect looked OK.  It doesn't scale properly with max_age.
-        max_level = self.size**2/2 * (1 - (1 - age*2)**2)
+        max_level = self.size**2/2 * (1 - (1 - ages*2)**2)
         # Take absolute difference of r-squared from the point of the
         # current maximum, clamp it between 0 and fuzz**2, convert to
-        # integer so we can use it to index the palette.
-        density = Numeric.clip(Numeric.absolute(self.rsq - max_level),
-                               0, fsq).astype(Numeric.Int)
-        colors = Numeric.take(palette, density)
-        pygame.surfarray.blit_array(mysurf, colors)
-        return mysurf
+        # integer so we can use it to index the palette.  This is
+        # done for all the frames at once, as a (frames, x, y) array.
+        density = numpy.clip(abs(rsq - max_level[:, None, None]),
+                             0, fsq).astype(numpy.intp)
+        # offset each frame's densities to index its own palette
+        density += (numpy.arange(self.nframes) * (fsq + 1))[:, None, None]
+        colors = numpy.take(palettes, density)
+        # lay the frames out one above the next: x, then frame and y
+        pygame.surfarray.blit_array(atlas, colors.transpose(1, 0, 2).reshape(
+            width, height * self.nframes))
+        return atlas
+    def __len__(self): return self.nframes
     def __getitem__(self, framenum):
         "Get a frame."
-        try: return self.frames[framenum]
-        except KeyError:
-            frame = self.render_frame(framenum)
-            self.frames[framenum] = frame
-            return frame
+        return self.frames[framenum]
 
-halo_movies = {}
+max_halo_movies = 16
+halo_movies = collections.OrderedDict()
 def get_halo_movie(*args):
-    "Find a requested halo movie."
+    "Find a requested halo movie, forgetting the least recently used ones."
     # This way multiple haloes of the same size (and other attributes)
     # can share the same rendered frames.
-    if halo_movies.has_key(args): return halo_movies[args]
-    halo_movies[args] = NumericHaloMovie(args)
-    return halo_movies[args]
+    try: movie = halo_movies.pop(args)
+    except KeyError: movie = NumericHaloMovie(args)
+    halo_movies[args] = movie           # move it to the most-recent end
+    while len(halo_movies) > max_halo_movies: halo_movies.popitem(last=False)
+    return movie
 
 class NumericHalo(Visible):
     "Draws a fading halo computed with Numerical Python."
-    def __init__(self, rect):
+    __slots__ = 'frames', 'frame', 'rect', 'start'
+    fuzz = 10
+    framelength = 1/120.0               # of a second.
+    max_age = lifetime = 0.4            # of a second
+    pool = FreeList()                   # by movie
+    def __init__(self, rect, frames=None):
         "rect is the area to draw the halo around."
-        fuzz = 10
-        self.framelength = 1/120.0      # of a second.
-        self.max_age = 0.4              # of a second
-        self.frames = get_halo_movie(self.framelength, rect.h,
-                                     self.max_age, fuzz)
-        pos = pdiff(self.frames[0].get_rect().center, rect.center)
-        self.rect = pygame.Rect(pos, self.frames[0].get_size())
+        self.frames = frames or self.movie_for(rect)
+        self.place(rect)
+    @classmethod
+    def make(cls, rect):
+        "A halo around rect, recycled if there's one the right size."
+        frames = cls.movie_for(rect)
+        halo = cls.pool.get(frames)
+        if halo is None: return cls(rect, frames)
+        halo.place(rect)
+        return halo
+    def place(self, rect):
+        "Start over, around rect."
+        self.frame = self.frames[0]
+        self.rect = self.frame.get_rect(center=rect.center)
         self.start = time.time()
-    def draw(self, world, surface):
-        "Blits the best frame for the halo's current age; possibly suicides."
+    def recycle(self): self.pool.put(self.frames, self)
+    @classmethod
+    def movie_for(cls, rect):
+        "Get the frames of a halo around rect, rendering them if need be."
+        return get_halo_movie(cls.framelength, rect.h, cls.max_age, cls.fuzz)
+    def advance(self, world):
+        "Picks the best frame for the halo's current age."
         age = time.time() - self.start
-        if age > self.max_age: world.delete(self)
-        else:
-            surface.blit(self.frames[int(age / self.framelength + 0.5)],
-                         self.rect.topleft)
+        self.frame = self.frames[min(int(age / self.framelength + 0.5),
+                                     len(self.frames) - 1)]
+        return [self.rect]
+    def draw(self, world, surface):
+        surface.blit(self.frame, self.rect.topleft)
 
 try:
-    # test to see if Numeric and surfarray are available
-    import Numeric
+    # test to see if NumPy and surfarray are available
+    import numpy
     pygame.surfarray.blit_array
-except:
-    make_halo = UglyHalo
+except (ImportError, NotImplementedError):
+    halo_class = UglyHalo
 else:
-    make_halo = NumericHalo
+    halo_class = NumericHalo
+
+def make_halo(rect):
+    "A halo around rect, new or recycled."
+    return halo_class.make(rect)
 
 ### Sound-making objects
 
@@ -312,13 +462,13 @@ class ScriptedDrag:
         self.duration = duration
         self.last_offset = (0, 0)
         world.prevent_button_release()
+        self.task = world.tasks.schedule(self.run, every=0) # every frame
     def run(self):
         now = time.time()
         if now - self.start >= self.duration:
+            self.task.cancel()
             self.world.defer(self.world.allow_button_release)
             now = self.start + self.duration
-        else:
-            self.world.defer(self.run)
         # 3t**2 - 2t**3 goes from (0, 0) to (1, 1) with a zero
         # derivative at both points
         t = (now - self.start) / self.duration
@@ -336,10 +486,14 @@ class ScriptedDrag:
         self.lastrun = now
 
 class Sound(ImageDisplay):
-    "A draggable sound that you can put in the tracks."
-    def __init__(self, pos, image, sound):
+    """A draggable sound that you can put in the tracks.
+
+    name is the name of the source it came from in world.sources, if
+    any, which is how it gets saved."""
+    def __init__(self, pos, image, sound, name=None):
         ImageDisplay.__init__(self, pos, image)
         self.sound = sound
+        self.name = name
     def move(self, delta): self.rect = self.rect.move(delta)
     def start_drag(self, world, ev):
         world.raise_to_top(self)
@@ -353,38 +507,72 @@ class Sound(ImageDisplay):
         self.start_drag(world, ev)
         self.play(world)
     def play(self, world):
-        "Plays the object's sound and kicks off a halo; called by timer."
+        "Plays the object's sound and kicks off a halo."
+        self.sound.play()
+        self.flash(world)
+    def hit(self, world, when):
+        "Plays the object's sound; called by the AudioScheduler."
         self.sound.play()
+        world.defer(self.flash, world)
+    def flash(self, world):
+        "Show that we've been played."
         world.add_nonclickable(make_halo(self.rect))
 
 class Trigger(Sound):
     """A draggable object that you can put in a timer to trigger some
     other thing, such as another timer."""
     # XXX currently inherits from Sound so as to be draggable.
-    def __init__(self, pos, image, gun):
+    def __init__(self, pos, image, gun, name=None):
         ImageDisplay.__init__(self, pos, image)
         self.gun = gun
+        self.name = name
     def play(self, world):
-        world.add_nonclickable(make_halo(self.rect))
         self.gun.trigger()
-        world.add_nonclickable(Line(self.center(), self.gun.triggerpoint(),
-                                    duration=0.2))
+        self.flash(world)
+    def hit(self, world, when):
+        self.gun.trigger(when)
+        world.defer(self.flash, world)
+    def flash(self, world):
+        world.add_nonclickable(make_halo(self.rect))
+        world.add_nonclickable(Line.make(self.center(),
+                                         self.gun.triggerpoint(),
+                                         duration=0.2))
 
 class Line(ImageDisplay):
     # XXX not antialiased and doesn't fade
     # neither pygame.draw.aaline nor pygame.draw.line supports the
     # alpha channel the way one might expect
+    __slots__ = 'start', 'end', 'lifetime'
+    pool = FreeList()                   # by end - start, which decides image
     def __init__(self, start, end, duration):
-        self.start = start
-        self.end = end
-        self.rect = pygame.Rect(start, pdiff(start, end))
-        self.rect.normalize()
-        self.starttime = time.time()
-        self.duration = duration
-    def draw(self, world, surface):
-        now = time.time()
-        if now > self.starttime + self.duration: world.delete(self)
-        else: pygame.draw.line(surface, white, self.start, self.end)
+        rect = self.bounds(start, end)
+        # We render the line once into an image with a transparent
+        # background, because pygame.draw.line picks slightly
+        # different pixels when it's clipped, and in incremental mode
+        # it gets drawn a piece at a time.
+        self.image = pygame.Surface(rect.size)
+        self.image.set_colorkey(black)
+        pygame.draw.line(self.image, white, pdiff(rect.topleft, start),
+                         pdiff(rect.topleft, end))
+        self.place(start, end, duration)
+    @staticmethod
+    def bounds(start, end):
+        rect = pygame.Rect(start, pdiff(start, end))
+        rect.normalize()
+        # the line includes both of its endpoints
+        rect.size = padd(rect.size, (1, 1))
+        return rect
+    @classmethod
+    def make(cls, start, end, duration):
+        "A Line, recycled if there's one with the same slope and length."
+        line = cls.pool.get(pdiff(start, end))
+        if line is None: return cls(start, end, duration)
+        line.place(start, end, duration)
+        return line
+    def place(self, start, end, duration):
+        self.start, self.end, self.lifetime = start, end, duration
+        self.rect = self.bounds(start, end)
+    def recycle(self): self.pool.put(pdiff(self.start, self.end), self)
 
 ### miscellaneous including the world
 
@@ -396,50 +584,385 @@ class Trash(ImageDisplay):
         world.add_nonclickable(make_halo(self.rect))
 
 class Profiler:
-    def __init__(self):
+    """Keeps track of where the time goes, frame by frame.
+
+    note(what) charges the time since the last note (or start) to
+    'what', both in a running total and as a span in the current
+    frame.  end_frame files the current frame away in a ring buffer of
+    the last 'keep' frames, which we can summarize as percentiles of
+    the frame time or dump in Chrome's trace-event format, to look at
+    in chrome://tracing or Perfetto.
+    """
+    def __init__(self, keep=600):
         self.times = {}
+        self.frames = collections.deque(maxlen=keep) # (start, dur, spans)
+        self.spans = []                 # (what, start, dur) this frame
+        self.frame_start = self.last_time = time.time()
     def __str__(self): return str(self.times)
-    def start(self): self.last_time = time.time()
+    def start(self):
+        "Start timing the current frame from now, e.g. after sleeping."
+        self.frame_start = self.last_time = time.time()
     def note(self, what):
         now = time.time()
         dur = now - self.last_time
+        self.spans.append((what, self.last_time, dur))
         self.last_time = now
         if not self.times.has_key(what): self.times[what] = 0
         self.times[what] += dur
+    def end_frame(self):
+        "Finish recording a frame and start on the next one."
+        now = time.time()
+        self.frames.append((self.frame_start, now - self.frame_start,
+                            self.spans))
+        self.frame_start = now
+        self.spans = []
+    def percentiles(self, percents=(50, 95, 99)):
+        "Return the given percentiles of the recent frame times, in seconds."
+        return pacing.percentiles([dur for start, dur, spans in self.frames],
+                                  percents)
+    def histogram(self, bucket=0.002):
+        "Count the recent frame times in buckets of 'bucket' seconds."
+        counts = collections.Counter(int(dur / bucket)
+                                     for start, dur, spans in self.frames)
+        return [(ii * bucket, counts[ii])
+                for ii in range(max(counts) + 1 if counts else 0)]
+    def summary(self):
+        "A line of text describing the recent frame times."
+        p50, p95, p99 = self.percentiles()
+        return ("%d frames: p50 %.1f ms, p95 %.1f ms, p99 %.1f ms"
+                % (len(self.frames), p50 * 1000, p95 * 1000, p99 * 1000))
+    def trace_events(self):
+        "The recent frames as a list of Chrome trace events."
+        us = lambda t: int(t * 1e6)
+        events = []
+        for frame, (start, dur, spans) in enumerate(self.frames):
+            events.append({'name': 'frame', 'ph': 'X', 'pid': 0, 'tid': 0,
+                           'ts': us(start), 'dur': us(dur),
+                           'args': {'frame': frame}})
+            events.extend({'name': what, 'ph': 'X', 'pid': 0, 'tid': 0,
+                           'ts': us(t), 'dur': us(d)}
+                          for what, t, d in spans)
+        return events
+    def dump_trace(self, filename):
+        "Write the recent frames to a Chrome trace-event JSON file."
+        with open(filename, 'w') as output:
+            json.dump({'traceEvents': self.trace_events(),
+                       'displayTimeUnit': 'ms'}, output)
+
+class SpatialIndex:
+    """A uniform grid for finding objects on the screen by position.
+
+    Each object is filed under every grid cell its rect touches, for
+    object_at, and under the single cell that holds its center, for
+    objects_in.  Objects also get a serial number when they're
+    inserted, so that we can recover the stacking order without
+    walking the whole list of objects.
+
+    The cells are lists rather than sets so that reading them from
+    another thread while the main thread moves things around can't
+    blow up.
+    """
+    cellsize = 32
+    def __init__(self):
+        self.rect_cells = {}            # (col, row) -> objects touching it
+        self.center_cells = {}          # (col, row) -> objects centered in it
+        self.filed = {}                 # obj -> (rect cell keys, center key)
+        self.z = {}                     # obj -> serial; higher is on top
+        self.serial = self.bottom_serial = 0
+    def cell(self, (x, y)):
+        "The key of the grid cell containing a point."
+        return (x // self.cellsize, y // self.cellsize)
+    def cells(self, rect):
+        "The keys of all the grid cells a rect touches."
+        cs = self.cellsize
+        return [(col, row)
+                for col in range(rect.left // cs, (rect.right - 1) // cs + 1)
+                for row in range(rect.top // cs, (rect.bottom - 1) // cs + 1)]
+    def insert(self, obj, bottom=False):
+        "File a new object on top of (or below) everything else."
+        if bottom:
+            self.bottom_serial -= 1
+            self.z[obj] = self.bottom_serial
+        else:
+            self.serial += 1
+            self.z[obj] = self.serial
+        self.file(obj)
+    def remove(self, obj):
+        "Forget about an object entirely."
+        self.unfile(obj)
+        del self.z[obj]
+    def remove_many(self, objs):
+        "Forget about a lot of objects, rebuilding each cell only once."
+        doomed = set(objs)
+        rect_keys, center_keys = set(), set()
+        for obj in doomed:
+            keys, center_key = self.filed.pop(obj)
+            del self.z[obj]
+            rect_keys.update(keys)
+            center_keys.add(center_key)
+        for cells, keys in ((self.rect_cells, rect_keys),
+                            (self.center_cells, center_keys)):
+            for key in keys:
+                cells[key] = [obj for obj in cells[key] if obj not in doomed]
+    def move(self, obj):
+        "Refile an object whose rect has changed, keeping its stacking order."
+        self.unfile(obj)
+        self.file(obj)
+    def file(self, obj):
+        keys = self.cells(obj.rect)
+        center_key = self.cell(obj.center())
+        for key in keys: self.rect_cells.setdefault(key, []).append(obj)
+        self.center_cells.setdefault(center_key, []).append(obj)
+        self.filed[obj] = (keys, center_key)
+    def unfile(self, obj):
+        keys, center_key = self.filed.pop(obj)
+        for key in keys: self.rect_cells[key].remove(obj)
+        self.center_cells[center_key].remove(obj)
+    def object_at(self, pos):
+        "Return the topmost object containing pos, or None."
+        best = None
+        for obj in self.rect_cells.get(self.cell(pos), ()):
+            if obj.contains(pos) and (best is None or
+                                      self.z[obj] > self.z[best]):
+                best = obj
+        return best
+    def touching(self, arect):
+        "Return the objects whose rects overlap arect, bottommost first."
+        found = set(obj
+                    for key in self.cells(arect)
+                    for obj in self.rect_cells.get(key, ())
+                    if arect.colliderect(obj.rect))
+        return sorted(found, key=self.z.get)
+    def centered_in(self, arect):
+        "Return the objects whose centers are in arect, bottommost first."
+        found = [obj
+                 for key in self.cells(arect)
+                 for obj in self.center_cells.get(key, ())
+                 if arect.collidepoint(obj.center())]
+        found.sort(key=self.z.get)
+        return found
+
+class ObjectStore:
+    """Visible objects in drawing order, bottommost first.
+
+    This acts enough like a list for the World's users, but adding
+    and removing take constant time, where list.remove has to search.
+    Iterating goes over a tuple snapshot, taken again only after a
+    change, which also makes it safe to iterate from another thread.
+    """
+    def __init__(self):
+        self.objs = collections.OrderedDict() # obj -> None, in order
+        self.items = ()                 # snapshot, or None after a change
+        self.lock = threading.Lock()
+    def snapshot(self):
+        items = self.items
+        if items is None:
+            with self.lock: items = self.items = tuple(self.objs)
+        return items
+    def __iter__(self): return iter(self.snapshot())
+    def __len__(self): return len(self.objs)
+    def __contains__(self, obj): return obj in self.objs
+    def __add__(self, other): return list(self.snapshot()) + list(other)
+    def add(self, obj, bottom=False):
+        "Put obj on top, or at the bottom, which takes linear time."
+        with self.lock:
+            if bottom:
+                objs = collections.OrderedDict([(obj, None)])
+                objs.update(self.objs)
+                self.objs = objs
+            else:
+                self.objs[obj] = None
+            self.items = None
+    def remove(self, obj):
+        with self.lock:
+            del self.objs[obj]
+            self.items = None
+    def remove_many(self, objs):
+        with self.lock:
+            for obj in objs: del self.objs[obj]
+            self.items = None
+
+class Task:
+    "A function scheduled on a TaskQueue, which you can cancel."
+    def __init__(self, function, args, every):
+        self.function, self.args, self.every = function, args, every
+        self.cancelled = False
+    def cancel(self):
+        "Don't run it again; also stops a repeating task."
+        self.cancelled = True
+
+class TaskQueue:
+    """Things to do at certain times, on the main thread, after redraw.
+
+    This is a heap of (when, serial, task), so each frame only looks
+    at the tasks that are due, however many are waiting for later.
+    Cancelled tasks just stay in the heap until they come up.  Any
+    thread can schedule things; run() only runs tasks that were due
+    when it started, so a task that schedules another, or itself, for
+    right away still waits until the next frame.
+    """
+    def __init__(self):
+        self.heap = []
+        self.serial = 0
+        self.lock = threading.Lock()    # the AudioScheduler schedules too
+    def __len__(self): return len(self.heap)
+    def schedule(self, function, when=None, every=None, args=()):
+        """Call function(*args) at time 'when', default now, and then
+        every 'every' seconds if that's not None; 0 means every frame.
+        Returns the Task."""
+        task = Task(function, args, every)
+        self.push(time.time() if when is None else when, task)
+        return task
+    def push(self, when, task):
+        with self.lock:
+            self.serial += 1
+            heapq.heappush(self.heap, (when, self.serial, task))
+    def run(self):
+        "Run whatever is due."
+        now = time.time()
+        due = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                due.append(heapq.heappop(self.heap))
+        for when, _, task in due:
+            if task.cancelled: continue
+            task.function(*task.args)
+            if task.every is not None and not task.cancelled:
+                self.push(max(when + task.every, now), task)
+
+class AudioScheduler(threading.Thread):
+    """Plays the things in the timers at the right times, in its own thread.
+
+    The timers used to decide what to play while drawing their
+    cursors, so the rhythm was only as steady as the frame rate.  This
+    looks a little way ahead of the clock instead, asking each timer
+    what it will play in the next few milliseconds, and then sleeps
+    until each of those moments comes around.  Since it wakes up much
+    more often than the screen gets redrawn, a slow frame doesn't
+    delay anything.
+
+    pygame.mixer can't start a sound at a given sample, so what we get
+    is as good as time.sleep's precision plus the mixer's buffer size,
+    but at least that doesn't jitter.
+    """
+    lookahead = 0.05                    # how far ahead to plan, in seconds
+    period = 0.005                      # longest time to sleep
+    def __init__(self, world):
+        threading.Thread.__init__(self, name='AudioScheduler')
+        self.daemon = True
+        self.world = world
+        self.planned = {}               # timer -> (start, planned up to)
+        self.queue = []                 # heap of (time, serial, object,
+                                        #          timer, its start)
+        self.serial = 0
+        self.running = True
+    def plan(self, now):
+        "Queue up everything any timer will play before now + lookahead."
+        until = now + self.lookahead
+        for timer in list(self.world.objects):
+            if not isinstance(timer, Timer): continue
+            with timer.lock:
+                restart = timer.start
+                start, horizon = self.planned.get(timer, (restart, now))
+            # If the timer has been restarted, e.g. by a Trigger,
+            # what we planned before is irrelevant; run() drops it.
+            # A timer we haven't seen before only plays from now on.
+            t0 = restart if restart != start else max(horizon, now)
+            for when, obj in timer.hits(self.world, t0, until):
+                self.serial += 1
+                heapq.heappush(self.queue,
+                               (when, self.serial, obj, timer, restart))
+            self.planned[timer] = (restart, until)
+    def run(self):
+        while self.running:
+            now = time.time()
+            self.plan(now)
+            while self.queue and self.queue[0][0] <= now:
+                when, _, obj, timer, start = heapq.heappop(self.queue)
+                if timer.start == start: obj.hit(self.world, when)
+            wakeup = now + self.period
+            if self.queue: wakeup = min(wakeup, self.queue[0][0])
+            time.sleep(max(0, wakeup - time.time()))
+    def stop(self):
+        self.running = False
+        self.join()
 
 class World:
     """Manages the set of stuff you see on the screen and routes
     events.  I think this is basically the Smalltalk MVC Controller."""
-    def __init__(self, screen):
-        "screen is an SDL/PyGame surface to draw on."
+    def __init__(self, screen, incremental=False):
+        """screen is an SDL/PyGame surface to draw on.
+
+        If incremental is true, redraw only repaints the parts of the
+        screen that changed, and returns their rects so that only they
+        need be copied to the display.
+        """
         self.screen = screen
-        self.objects = []               # clickable visible objects
-        self.nonclickable_objects = []  # halos and such
+        self.incremental = incremental
+        self.damage = [screen.get_rect()] # areas changed since last redraw
+        self.objects = ObjectStore()    # clickable visible objects
+        self.nonclickable_objects = ObjectStore() # halos and such
+        self.index = SpatialIndex()     # where the clickable objects are
         self.grab(None, None)           # initialize drag state
-        self.redraw_profiler = Profiler()
-        self.deferreds = []
+        self.profiler = Profiler()      # main notes events and flips too
+        self.tasks = TaskQueue()
         self.queued_release_events = None
+        self.audio = None               # an AudioScheduler, once started
+        self.sources = {}               # name -> function to make one at pos
+        self.pacer = None               # a FramePacer to wake for new tasks
+        self.animating = True           # will the next frame look different?
     def redraw(self):
-        "This gets called whenever there's idle time, i.e. each frame."
-        self.screen.fill(black)
-        self.redraw_profiler.start()
+        """This gets called whenever there's idle time, i.e. each frame.
+
+        Returns the list of rects that changed, or None if the whole
+        screen was redrawn.  Afterwards, self.animating says whether
+        anything is still moving, so the next frame will look
+        different even if there's no input.
+        """
+        moved = []
         for obj in self.objects + self.nonclickable_objects:
+            moved.extend(obj.advance(self))
+        self.damage.extend(moved)
+        self.profiler.note('advance')
+        if self.incremental:
+            rects = merge_rects(self.damage, self.screen.get_rect())
+            for rect in rects: self.repaint(rect)
+            self.screen.set_clip(None)
+        else:
+            rects = None
+            self.screen.fill(black)
+            self.profiler.note('fill')
+            for obj in self.objects + self.nonclickable_objects:
+                obj.draw(self, self.screen)
+                self.profiler.note(obj.__class__.__name__)
+        self.damage = []
+        self.tasks.run()
+        self.profiler.note('tasks')
+        # a cursor that moved less than a pixel still reports a rect
+        self.animating = bool(self.damage or self.tasks or moved)
+        return rects
+    def repaint(self, rect):
+        "Redraw just the objects that overlap a rect."
+        self.screen.set_clip(rect)
+        self.screen.fill(black, rect)
+        for obj in self.index.touching(rect) + [
+                obj for obj in self.nonclickable_objects
+                if rect.colliderect(obj.rect)]:
             obj.draw(self, self.screen)
-            self.redraw_profiler.note(obj.__class__.__name__)
-        self.run_deferreds()
-    def run_deferreds(self):
-        "Run any deferred tasks."
-        deferreds = self.deferreds
-        # ensure that tasks deferred by deferred tasks don't run until
-        # the next frame:
-        self.deferreds = []
-        for task in deferreds: task()
-    def defer(self, task):
-        "Enqueue a task to be done as soon as possible after redraw."
-        self.deferreds.append(task)
-    def add(self, obj):
-        "Call to put a new visible, clickable object on the screen."
-        self.objects.append(obj)
+            self.profiler.note(obj.__class__.__name__)
+    def invalidate(self, rect):
+        "Note that an area of the screen needs to be repainted."
+        self.damage.append(pygame.Rect(rect))
+    def defer(self, task, *args):
+        "Enqueue task(*args) to be done as soon as possible after redraw."
+        self.tasks.schedule(task, args=args)
+        if self.pacer is not None: self.pacer.wake()
+    def add(self, obj, bottom=False):
+        """Call to put a new visible, clickable object on the screen,
+        on top of the others, or underneath them if bottom is true."""
+        self.objects.add(obj, bottom)
+        self.index.insert(obj, bottom)
+        self.invalidate(obj.rect)
     def add_nonclickable(self, obj):
         """Like add, but for nonclickable objects above everything.
 
@@ -448,12 +971,14 @@ class World:
         supposed to impede the clickability of the objects they're
         haloing around.
         """
-        self.nonclickable_objects.append(obj)
+        self.nonclickable_objects.add(obj)
+        self.invalidate(obj.rect)
+        if obj.lifetime is not None:
+            self.tasks.schedule(self.delete, time.time() + obj.lifetime,
+                                args=(obj,))
     def object_at(self, pos):
         "Return the topmost object at pos, or None."
-        # iterate backwards so objects drawn "on top" get first choice
-        for ii in range(len(self.objects)-1, -1, -1):
-            if self.objects[ii].contains(pos): return self.objects[ii]
+        return self.index.object_at(pos)
     def handle_click(self, ev):
         "Route a click event to the relevant object."
         obj = self.object_at(ev.pos)
@@ -468,8 +993,14 @@ class World:
     def handle_motion(self, ev):
         "Handle mouse motion, by doing a mouse drag if needed."
         if self.dragobj is None: return
-        self.dragobj.move(pdiff(self.dragpos, ev.pos))
+        self.move(self.dragobj, pdiff(self.dragpos, ev.pos))
         self.dragpos = ev.pos
+    def move(self, obj, delta):
+        "Move a draggable object, keeping the index up to date."
+        self.invalidate(obj.rect)
+        obj.move(delta)
+        self.index.move(obj)
+        self.invalidate(obj.rect)
     def ungrab(self):
         "Terminate any drag."
         if self.dragobj is not None: self.dragobj.handle_drop(self)
@@ -481,8 +1012,17 @@ class World:
         "Remove a visible object (clickable or not) from the world."
         if obj in self.nonclickable_objects:
             self.nonclickable_objects.remove(obj)
+            obj.recycle()
         else:
             self.objects.remove(obj)
+            self.index.remove(obj)
+        self.invalidate(obj.rect)
+    def delete_many(self, objs):
+        "Remove a lot of clickable objects at once, faster than one by one."
+        doomed = set(objs)
+        self.objects.remove_many(doomed)
+        self.index.remove_many(doomed)
+        for obj in doomed: self.invalidate(obj.rect)
     def raise_to_top(self, obj):
         "Move an object to the top of the drawing stack."
         self.delete(obj)
@@ -492,8 +1032,7 @@ class World:
 
         This is used by the timer to figure out what to play.
         """
-        return [obj for obj in self.objects
-                if arect.contains(pygame.Rect(obj.center(), (1, 1,)))]
+        return self.index.centered_in(arect)
     # for scripted drags:
     def prevent_button_release(self):
         self.queued_release_events = []
@@ -502,6 +1041,51 @@ class World:
         self.queued_release_events = None
         for event in release_events: self.handle_release(event)
 
+def merge_rects(rects, bounds):
+    """Clip rects to bounds and merge the overlapping ones.
+
+    This keeps us from repainting the same pixels several times when,
+    say, a halo sits on top of a timer cursor.
+    """
+    merged = []
+    for rect in rects:
+        rect = rect.clip(bounds)
+        if not rect.w or not rect.h: continue
+        # absorb everything this overlaps, then check again, since
+        # the union may overlap things the original didn't
+        ii = 0
+        while ii < len(merged):
+            if rect.colliderect(merged[ii]):
+                rect = rect.union(merged.pop(ii))
+                ii = 0
+            else:
+                ii += 1
+        merged.append(rect)
+    return merged
+
+def coalesce_motion(events):
+    """Merge each run of consecutive MOUSEMOTION events into one.
+
+    The merged event has the position and buttons of the last one in
+    the run and the sum of their relative motions, so a drag ends up
+    in the same place.  Everything else stays in order, so clicks and
+    releases still happen between the motions before and after them.
+    """
+    rv, run = [], []
+    for ev in events + [None]:
+        if ev is not None and ev.type == pygame.MOUSEMOTION:
+            run.append(ev)
+            continue
+        if len(run) == 1: rv.append(run[0])
+        elif run:
+            rel = (sum(motion.rel[0] for motion in run),
+                   sum(motion.rel[1] for motion in run))
+            rv.append(pygame.event.Event(pygame.MOUSEMOTION, pos=run[-1].pos,
+                                         rel=rel, buttons=run[-1].buttons))
+        run = []
+        if ev is not None: rv.append(ev)
+    return rv
+
 def make_icon():
     size = 32
     icon_surface = pygame.Surface((size, size))
@@ -509,19 +1093,207 @@ def make_icon():
     try:
         halo = get_halo_movie(1/100.0, size/2, 1, 10)[10]
         icon_surface.blit(halo, (0, 0))
-    except: pass # maybe we don't have Numeric
+    except: pass # maybe we don't have NumPy
     return icon_surface
 
-def main(argv):
-    "Main program."
-    mydir = os.path.split(argv[0])[0]
-    pygame.init()
-    pygame.display.set_caption("Pygmusic sequencer")
-    screen = pygame.display.set_mode((640, 480), pygame.FULLSCREEN)
-    pygame.display.set_icon(make_icon())
-    fullscreen = True
+### offline rendering
+
+def bounce_hits(world, cycles):
+    """Work out everything the timers in world will play over the next
+    'cycles' cycles of the slowest repeating timer, without waiting.
+
+    This runs on copies of the timers, so that Triggers restarting
+    timers along the way don't disturb the real ones; a Trigger whose
+    timer isn't in the world does nothing.  Returns the start time,
+    the duration, and a time-sorted list of (time, Sound).
+    """
+    clones = dict((obj, copy.copy(obj)) for obj in world.objects
+                  if isinstance(obj, Timer))
+    if not clones: raise ValueError("there are no timers to play")
+    repeating = [timer for timer in clones.values()
+                 if isinstance(timer, RepeatingTimer) and timer.active]
+    slowest = max(repeating or clones.values(), key=lambda t: t.cycletime)
+    # start at the beginning of the slowest timer's cycle, so that
+    # the result loops
+    now = time.time()
+    start = now - (now - slowest.start) % slowest.cycletime
+    duration = cycles * slowest.cycletime
+    end = start + duration
+    # Like the AudioScheduler: a heap of (time, serial, object, timer,
+    # its start), where a hit is dropped if its timer has been
+    # restarted since.  Each timer is planned a cycle at a time, with
+    # an object of None to plan the next one, so restarting it only
+    # throws away one cycle.
+    queue, serials = [], itertools.count()
+    def plan(timer, t0):
+        t1 = min(end, t0 + timer.cycletime)
+        for when, obj in timer.hits(world, t0, t1):
+            if isinstance(obj, Sound):
+                heapq.heappush(queue, (when, next(serials), obj, timer,
+                                       timer.start))
+        if t1 < end:
+            heapq.heappush(queue, (t1, next(serials), None, timer,
+                                   timer.start))
+    played = []
+    for timer in clones.values(): plan(timer, start)
+    while queue:
+        when, _, obj, timer, started = heapq.heappop(queue)
+        if timer.start != started: continue
+        if obj is None:
+            plan(timer, when)
+        elif not isinstance(obj, Trigger):
+            played.append((when, obj))
+        elif obj.gun in clones:
+            gun = clones[obj.gun]
+            # a second Trigger at the same moment changes nothing
+            if gun.start == when and gun.active: continue
+            gun.trigger(when)
+            plan(gun, when)
+    return start, duration, played
+
+def bounce(world, filename, cycles=1):
+    """Render what the timers will play over 'cycles' cycles of the
+    slowest one to a WAV file, faster than real time.
 
-    world = World(screen)
+    Every sound is mixed in at the exact sample where the AudioScheduler
+    would have started it, and anything still sounding at the end
+    wraps around to the beginning, so the file loops seamlessly.
+    """
+    rate, format, channels = pygame.mixer.get_init()
+    start, duration, played = bounce_hits(world, cycles)
+    nsamples = int(round(duration * rate))
+    mix = numpy.zeros((nsamples, channels))
+    samples = {}                        # pygame Sound -> array of samples
+    for when, obj in played:
+        if obj.sound not in samples:
+            samples[obj.sound] = (pygame.sndarray.array(obj.sound)
+                                  .reshape(-1, channels)
+                                  * obj.sound.get_volume())
+        sound = samples[obj.sound]
+        offset = int(round((when - start) * rate)) % nsamples
+        # in pieces, in case it wraps around (more than once, even)
+        done = 0
+        while done < len(sound):
+            piece = min(len(sound) - done, nsamples - offset)
+            mix[offset:offset + piece] += sound[done:done + piece]
+            done, offset = done + piece, 0
+    output = wave.open(filename, 'wb')
+    output.setnchannels(channels)
+    output.setsampwidth(2)
+    output.setframerate(rate)
+    output.writeframes(numpy.clip(mix, -32768, 32767)
+                       .astype('<i2').tostring())
+    output.close()
+    return len(played)
+
+### saving and loading arrangements
+
+timer_record = [('repeating', '?'), ('left', '<i4'), ('top', '<i4'),
+                ('width', '<i4'), ('height', '<i4'), ('cycletime', '<f8'),
+                ('divisions', '<i4'), ('color', '<i4'), ('active', '?'),
+                ('phase', '<f8')]
+sound_record = [('name', '<i4'), ('left', '<i4'), ('top', '<i4'),
+                ('gun', '<i4')]
+
+def arrangement(world):
+    """The timers and the named sounds in world, as NumPy record arrays.
+
+    Returns (timers, sounds, names).  A sound's name field indexes
+    names, and its gun field is the index of the timer a Trigger
+    triggers, or -1.
+    """
+    timers = [obj for obj in world.objects if isinstance(obj, Timer)]
+    sounds = [obj for obj in world.objects
+              if isinstance(obj, Sound) and obj.name is not None]
+    names = sorted(set(sound.name for sound in sounds))
+    timer_numbers = dict((timer, ii) for ii, timer in enumerate(timers))
+    name_numbers = dict((name, ii) for ii, name in enumerate(names))
+    timer_records = numpy.array(
+        [(isinstance(timer, RepeatingTimer),) + tuple(timer.rect) +
+         (timer.cycletime, timer.divisions, timer.color, timer.active,
+          timer.time() / timer.cycletime) for timer in timers],
+        timer_record)
+    sound_records = numpy.array(
+        [(name_numbers[sound.name], sound.rect.left, sound.rect.top,
+          timer_numbers.get(getattr(sound, 'gun', None), -1))
+         for sound in sounds], sound_record)
+    return timer_records, sound_records, numpy.array(names, str)
+
+def save_world(world, filename):
+    "Save the arrangement of timers and sounds in world to an .npz file."
+    timers, sounds, names = arrangement(world)
+    with open(filename, 'wb') as output:
+        numpy.savez(output, timers=timers, sounds=sounds, names=names)
+
+def load_world(world, filename):
+    """Change the arrangement in world to the one saved in filename.
+
+    This only touches what differs: timers already in the same place
+    with the same settings keep running in time, ones with other
+    settings take them and go back to their saved phase, sounds
+    already in place stay, and the rest are deleted or made with
+    world.sources.  So it can be done while
+    the AudioScheduler is playing.  Returns the number of sounds that
+    couldn't be made because their source doesn't exist here.
+    """
+    saved = numpy.load(filename)
+    names = [str(name) for name in saved['names']]
+    now = time.time()
+    world.grab(None, None)              # whatever was being dragged may go
+    existing = dict(((isinstance(obj, RepeatingTimer), tuple(obj.rect)), obj)
+                    for obj in world.objects if isinstance(obj, Timer))
+    timers = []
+    for (repeating, left, top, width, height, cycletime, divisions, color,
+         active, phase) in saved['timers'].tolist():
+        rect = (left, top, width, height)
+        timer = existing.pop((repeating, rect), None)
+        if timer is None:
+            kind = RepeatingTimer if repeating else Timer
+            timer = kind(rect=pygame.Rect(rect), cycletime=cycletime,
+                         color=color, active=active, divisions=divisions)
+            timer.start = now - phase * cycletime
+            world.add(timer, bottom=True) # under the sounds
+        elif ((timer.cycletime, timer.divisions, timer.color, timer.active)
+              != (cycletime, divisions, color, active)):
+            with timer.lock:
+                timer.cycletime, timer.divisions = cycletime, divisions
+                timer.color, timer.active = color, active
+                timer.start = now - phase * cycletime
+                timer.lastoffset = timer.offset()
+                # skip what's before the phase rather than play it now
+                if world.audio is not None:
+                    world.audio.planned[timer] = timer.start, now
+            world.invalidate(timer.rect)
+        timers.append(timer)
+    world.delete_many(existing.values())
+
+    timer_numbers = dict((timer, ii) for ii, timer in enumerate(timers))
+    wanted = collections.Counter((names[name], left, top, gun)
+                                 for name, left, top, gun
+                                 in saved['sounds'].tolist())
+    unwanted = []
+    for obj in world.objects:
+        if not isinstance(obj, Sound) or obj.name is None: continue
+        key = (obj.name, obj.rect.left, obj.rect.top,
+               timer_numbers.get(getattr(obj, 'gun', None), -1))
+        if wanted[key] > 0: wanted[key] -= 1
+        else: unwanted.append(obj)
+    world.delete_many(unwanted)
+    missing = 0
+    for (name, left, top, gun), count in wanted.items():
+        if name not in world.sources:
+            missing += count
+            continue
+        for ii in range(count):
+            obj = world.sources[name]((left, top))
+            if gun >= 0: obj.gun = timers[gun]
+            world.add(obj)
+    return missing
+
+def build_world(screen, argv):
+    "Set up the initial arrangement of sources, timers, and sounds."
+    mydir = os.path.split(argv[0])[0]
+    world = World(screen, incremental='--dirty' in argv)
     timerwidth = 440
     def timer(y, cycletime, color, active=True):
         world.add(RepeatingTimer(rect=pygame.Rect((100, y), (timerwidth,30)),
@@ -529,14 +1301,15 @@ def main(argv):
                         divisions=cycletime))
 
     font = pygame.font.Font(None, 24)   # use default font, 24 pixels high
-    def getsound(soundname):
-        path = os.path.join(mydir, soundname + '.wav')
-        return pygame.mixer.Sound(path)
+    samples = samplebank.SampleBank(mydir or '.')
+    def getsound(soundname): return samples.get(soundname + '.wav')
     def renderletter(letter, color): return font.render(letter, 1, color)
     def addsource(xpos, letter, soundname):
         image = renderletter(letter, white)
         sound = getsound(soundname)
-        make = lambda pos: Sound(pos=pos, image=image, sound=sound)
+        make = lambda pos: Sound(pos=pos, image=image, sound=sound,
+                                 name=soundname)
+        world.sources[soundname] = make
         source = DragSource(pos=(xpos, 80),
                             image=renderletter(letter, (255, 128, 128)),
                             instance=make)
@@ -564,9 +1337,10 @@ def main(argv):
                     cycletime=1, color=128, active=True,
                     divisions=6)
     world.add(mytimer)
+    world.sources['trigger'] = lambda pos: Trigger(
+        pos, renderletter("E", white), mytimer, name='trigger')
     world.add(DragSource((75, 250), image=renderletter("E", (255, 128, 128)),
-                         instance = lambda pos:
-                             Trigger(pos, renderletter("E", white), mytimer)))
+                         instance=world.sources['trigger']))
 
     trashf = os.path.join(mydir, 'trashcan_empty.png')
     world.add(Trash((100, 300), pygame.image.load(trashf).convert()))
@@ -576,32 +1350,110 @@ def main(argv):
         font.render("Drag things around with the mouse.", 1, white)))
     world.add(ImageDisplay((200, 320),
         font.render("The right mouse button exits.", 1, white)))
+    return world
+
+def main(argv):
+    "Main program."
+    # Bouncing only needs a display to convert the images for, so it
+    # uses SDL's offscreen one rather than taking over the screen.
+    bouncing = '--bounce' in argv
+    if bouncing: os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    pygame.init()
+    pygame.display.set_caption("Pygmusic sequencer")
+    fullscreen = not bouncing
+    screen = pygame.display.set_mode((640, 480),
+                                     pygame.FULLSCREEN if fullscreen else 0)
+    pygame.display.set_icon(make_icon())
+
+    world = build_world(screen, argv)
+    if '--load' in argv:
+        load_world(world, argv[argv.index('--load') + 1])
+    if bouncing:
+        filename = argv[argv.index('--bounce') + 1]
+        cycles = (int(argv[argv.index('--cycles') + 1])
+                  if '--cycles' in argv else 1)
+        print 'bounced %d hits to %s' % (bounce(world, filename, cycles),
+                                         filename)
+        return
+
+    # Render the halos for everything now, so that playing never stalls.
+    if halo_class is NumericHalo:
+        for obj in world.objects: NumericHalo.movie_for(obj.rect)
+
+    world.audio = AudioScheduler(world)
+    world.audio.start()
+
+    # Press S to save the arrangement and L to go back to it.
+    arrangement_file = 'pygmusic-world.npz'
+
+    # Draw at most 60 fps, and nothing at all while nothing moves.
+    pacer = world.pacer = pacing.FramePacer.from_argv(argv, mode='idle')
+
+    # Press P or send SIGUSR1 to save a trace of the last few seconds.
+    trace_requests = []
+    def request_trace(signum, frame): trace_requests.append(signum)
+    if hasattr(signal, 'SIGUSR1'): signal.signal(signal.SIGUSR1, request_trace)
 
     frames = 0
     start = time.time()
-    while 1:
-        ev = pygame.event.poll()
-        if ev.type == pygame.NOEVENT:
-            world.redraw()
-            frames += 1
-            pygame.display.flip()
-        elif ev.type == pygame.MOUSEMOTION:
-            world.handle_motion(ev)
-        elif ev.type == pygame.MOUSEBUTTONDOWN:
-            if ev.button == 3: break
-            world.handle_click(ev)
-        elif ev.type == pygame.MOUSEBUTTONUP:
-            world.handle_release(ev)
-        elif ev.type == pygame.KEYDOWN:
-            if ev.key == pygame.K_f:
-                fullscreen = not fullscreen
-                if fullscreen:
-                    pygame.display.set_mode((640, 480), pygame.FULLSCREEN)
-                else:
-                    pygame.display.set_mode((640, 480)) # without FULLSCREEN
-        elif ev.type == pygame.QUIT: break
+    quitting = False
+    while not quitting:
+        pacer.wait(world.animating)
+        world.profiler.start()          # not counting the wait
+        # Take everything that came in since the last frame at once, so
+        # that a flood of mouse motion can't hold up redrawing.
+        for ev in coalesce_motion(pygame.event.get()):
+            if ev.type == pygame.MOUSEMOTION:
+                world.handle_motion(ev)
+            elif ev.type == pygame.MOUSEBUTTONDOWN:
+                if ev.button == 3: quitting = True
+                else: world.handle_click(ev)
+            elif ev.type == pygame.MOUSEBUTTONUP:
+                world.handle_release(ev)
+            elif ev.type == pygame.KEYDOWN:
+                if ev.key == pygame.K_f:
+                    fullscreen = not fullscreen
+                    if fullscreen:
+                        pygame.display.set_mode((640, 480), pygame.FULLSCREEN)
+                    else:
+                        pygame.display.set_mode((640, 480)) # no FULLSCREEN
+                    world.invalidate(screen.get_rect())
+                elif ev.key == pygame.K_p:
+                    trace_requests.append(ev.key)
+                elif ev.key == pygame.K_s:
+                    save_world(world, arrangement_file)
+                    print 'saved', arrangement_file
+                elif (ev.key == pygame.K_l
+                      and os.path.exists(arrangement_file)):
+                    missing = load_world(world, arrangement_file)
+                    print 'loaded', arrangement_file,
+                    print '(%d sounds missing)' % missing if missing else ''
+            elif ev.type == pygame.QUIT: quitting = True
+            if quitting: break
+        if quitting: break
+
+        world.profiler.note('events')
+        rects = world.redraw()
+        frames += 1
+        if rects is None: pygame.display.flip()
+        else: pygame.display.update(rects)
+        world.profiler.note('display.flip')
+        world.profiler.end_frame()
+        if trace_requests:
+            filename = 'pygmusic-trace-%d.json' % time.time()
+            world.profiler.dump_trace(filename)
+            print 'wrote', filename
+            del trace_requests[:]
+    world.audio.stop()
     end = time.time()
     print "%.2f seconds, %.2f fps" % ((end - start), frames / (end - start))
-    print 'redraw times', world.redraw_profiler
+    print 'frame times', world.profiler
+    print world.profiler.summary()
+    histogram = world.profiler.histogram()
+    most = max([count for ms, count in histogram] or [1])
+    for seconds, count in histogram:
+        if count: print '%4.0f ms %5d %s' % (seconds * 1000, count,
+                                            '#' * (count * 50 // most))
+    print pacer.summary()
 
 if __name__ == '__main__': main(sys.argv)
@@ -1,5 +1,6 @@
 #!/usr/bin/python
 from pygame import *
+from pacing import FramePacer
 
 init()
 pantalla = display.set_mode((0, 0), FULLSCREEN)
@@ -8,6 +9,7 @@ imagen = image.load('trashcan_empty.png')
 clic = mixer.Sound('menu_click.wav')
 
 xx, yy = 0, hh/2
+reloj = FramePacer(30, 'adaptive')      # 30 cuadros por segundo
 while True:
     ev = event.poll()
     if ev.type in (QUIT, MOUSEBUTTONDOWN):
@@ -15,9 +17,9 @@ while True:
     elif ev.type == MOUSEMOTION:
         _, yy = ev.pos                  # posicion
         continue
-    time.delay(33)
+    pasos = reloj.wait()                # si nos atrasamos, mas de uno
 
-    xx += 23
+    xx += 23 * pasos
     if xx > ww:
         xx -= ww
         clic.play()                     # empezar sonido
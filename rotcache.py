@@ -0,0 +1,96 @@
+#!/usr/bin/python
+"""Rotated copies of surfaces, computed once and reused.
+
+transform.rotate is much too slow to call on every frame for every
+sprite, but demos that spin things usually only need a few hundred
+different angles of each image.  A RotationCache keeps the rotated
+(and optionally scaled) copies, keyed by (source surface, quantized
+angle, scale), up to its budget of bytes.  Once that's full it keeps
+what it has and just rotates anything else every time it's asked
+for: sprites that spin go through their angles in a cycle, so evicting
+the least recently used rotation to make room would always throw out
+the one that's needed next, and nothing would ever be found.  A
+spinner then looks like this:
+
+    cache = RotationCache()
+    while ...:
+        rotated = cache.get(polygon, theta)
+        pantalla.blit(rotated, rotated.get_rect(center=(200, 200)))
+
+It can also compute all the angles of some surfaces in a background
+thread before they're needed, with prewarm.
+"""
+import pygame, threading
+
+class RotationCache:
+    """Rotations of surfaces in steps of 360/steps degrees, up to
+    budget bytes of them."""
+    def __init__(self, steps=180, budget=256 * 1024 * 1024):
+        self.steps, self.budget = steps, budget
+        self.entries = {}
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def quantize(self, angle):
+        "The step nearest to angle, in degrees."
+        return int(round(angle * self.steps / 360.0)) % self.steps
+
+    def get(self, surface, angle, scale=1):
+        "surface rotated by angle degrees (rounded) and scaled by scale."
+        key = surface, self.quantize(angle), scale
+        with self.lock:
+            rotated = self.entries.get(key)
+            if rotated is not None:
+                self.hits += 1
+                return rotated
+            self.misses += 1
+        rotated = self.rotate(key)
+        with self.lock: self.insert(key, rotated)
+        return rotated
+
+    def rotate(self, key):
+        surface, quantum, scale = key
+        angle = quantum * 360.0 / self.steps
+        if scale == 1: return pygame.transform.rotate(surface, angle)
+        return pygame.transform.rotozoom(surface, angle, scale)
+
+    def insert(self, key, rotated):
+        "Keep rotated, if it fits in the budget; return whether it did."
+        if key in self.entries: return True
+        if self.bytes + size_of(rotated) > self.budget: return False
+        self.entries[key] = rotated
+        self.bytes += size_of(rotated)
+        return True
+
+    def clear(self):
+        "Forget every rotation, e.g. when the surfaces have changed."
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def prewarm(self, surfaces, scale=1):
+        """Start computing every angle of the given surfaces in a
+        background thread, until the budget is full.  Returns the
+        thread.
+
+        The smallest surfaces go first, all their angles at once, so
+        that as many of them as fit are found at every angle and the
+        budget isn't spent on a few angles of each."""
+        thread = threading.Thread(target=self.warm, args=(surfaces, scale))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def warm(self, surfaces, scale):
+        for surface in sorted(set(surfaces), key=size_of):
+            for quantum in range(self.steps):
+                key = surface, quantum, scale
+                with self.lock:
+                    if key in self.entries: continue
+                rotated = self.rotate(key)
+                with self.lock:
+                    if not self.insert(key, rotated): return
+
+def size_of(surface):
+    return surface.get_width() * surface.get_height() * surface.get_bytesize()
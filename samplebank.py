@@ -0,0 +1,96 @@
+#!/usr/bin/python
+"""A directory of samples, decoded once and shared.
+
+Decoding every sample into a mixer.Sound at startup takes seconds when
+there are hundreds of them, and decoding the same file again for every
+user wastes memory.  A SampleBank just lists the directory at first;
+it decodes each file the first time someone asks for it, or ahead of
+time in a background thread with preload, and after that everybody
+who asks for it gets the same Sound.  mixer.Sound converts the
+samples to the mixer's rate and format as it decodes them, so that
+only happens once per file too.
+
+When the decoded samples add up to more than the budget, the least
+recently used ones that nobody else holds on to are dropped from the
+bank; they come back the next time someone asks for them.  One that
+is playing, or that anyone still has, stays, even over the budget,
+since dropping it wouldn't free its memory, and asking for it again
+would then decode a second Sound for the same file.
+"""
+import pygame, os, sys, threading, collections
+
+class SampleBank:
+    """The sound files in directory, as mixer Sounds.
+
+    The mixer has to be initialized before you ask for a sample."""
+    extensions = '.wav', '.ogg'
+    def __init__(self, directory, budget=256 * 1024 * 1024):
+        self.directory, self.budget = directory, budget
+        self.names = sorted(name for name in os.listdir(directory)
+                            if os.path.splitext(name)[1].lower()
+                               in self.extensions)
+        self.sounds = collections.OrderedDict()  # -> (Sound, bytes), LRU first
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def get(self, name):
+        "The Sound for the file name in the directory."
+        with self.lock:
+            entry = self.sounds.pop(name, None)
+            if entry is not None:
+                self.sounds[name] = entry
+                return entry[0]
+        sound = self.decode(name)
+        with self.lock:
+            # another thread may have decoded it meanwhile; keep theirs
+            entry = self.sounds.pop(name, None) or (sound, size_of(sound))
+            self.sounds[name] = entry
+            if entry[0] is sound: self.bytes += entry[1]
+            self.evict()
+            return entry[0]
+
+    def decode(self, name):
+        return pygame.mixer.Sound(os.path.join(self.directory, name))
+
+    def evict(self):
+        "Drop samples nobody is using, oldest first, to fit the budget."
+        for name in list(self.sounds):
+            if self.bytes <= self.budget: break
+            sound, size = self.sounds[name]
+            # referred to by our entry, sound, and getrefcount's argument
+            if sound.get_num_channels() or sys.getrefcount(sound) > 3:
+                continue
+            del self.sounds[name]
+            self.bytes -= size
+
+    def preload(self, names=None):
+        """Start decoding the given samples, or all of them, in a
+        background thread, until the budget is full.  Returns the
+        thread."""
+        thread = threading.Thread(target=self.load_all,
+                                  args=(names or self.names,))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def load_all(self, names):
+        for name in names:
+            with self.lock:
+                if self.bytes >= self.budget: return
+                if name in self.sounds: continue
+            sound = self.decode(name)
+            with self.lock:
+                if name not in self.sounds:
+                    self.sounds[name] = sound, size_of(sound)
+                    self.bytes += self.sounds[name][1]
+
+def size_of(sound):
+    "Bytes of samples in sound."
+    rate, format, channels = pygame.mixer.get_init()
+    return int(sound.get_length() * rate) * channels * (abs(format) // 8)
@@ -1,68 +1,245 @@
 #!/usr/bin/python
 """Triangulo de sierpinski por IFS inverso.
+
+Cada pixel guarda una cota inferior de cuantas veces hay que aplicar
+las transformaciones (inversas) del IFS para que salga de la
+pantalla.  En cada cuadro, la cota de un pixel pasa a ser la mayor de
+las cotas de sus imagenes, mas uno.
 """
-import Numeric, pygame, random
+import numpy, pygame, random
 
 pantalla = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
 pygame.mouse.set_visible(False)
 ww, hh = pantalla.get_size()
 
-transforms = [lambda x, y: (x * 2 - ww/2,        y * 2 - 1 * hh/5),
-              lambda x, y: (x * 2 - ww/2 - hh/2, y * 2 - 4 * hh / 5),
-              lambda x, y: (x * 2 - ww/2 + hh/2, y * 2 - 4 * hh / 5),
-# descomentar para efectos alucinantes:
-#              lambda x, y: (x * 2 - ww/2,       -y * 2 + 8 * hh/5),
-#              lambda x, y: (y * 2 - ww/2,       -x * 2 + 8 * hh/5),
+# Transformaciones afines (a, b, c, d, e, f), que llevan el pixel (x, y)
+# a (a*x + b*y + c, d*x + e*y + f).
+transforms = [(2, 0, -(ww/2),        0, 2, -(1 * hh/5)),
+              (2, 0, -(ww/2) - hh/2, 0, 2, -(4 * hh/5)),
+              (2, 0, -(ww/2) + hh/2, 0, 2, -(4 * hh/5)),
               ]
+# con la tecla t se agregan o se sacan estas, para efectos alucinantes:
+alucinantes = [(2, 0, -(ww/2),        0, -2, 8 * hh/5),
+               (0, 2, -(ww/2),       -2,  0, 8 * hh/5),
+               ]
 
-xs, ys = Numeric.indices((ww, hh))
-
-bounded_coords = []
-for transform in transforms:
-    xps, yps = transform(xs, ys)
+class IFS:
+    """El campo de cotas inferiores, con todo lo que se puede calcular
+    de antemano ya calculado.
 
-    in_bounds = Numeric.logical_and(
-        Numeric.logical_and(xps >= 0, xps < ww),
-        Numeric.logical_and(yps >= 0, yps < hh))
+    Si una transformacion solo escala y refleja los ejes (o los
+    intercambia) por enteros, como las del triangulo, la imagen de un
+    rectangulo de la pantalla es otro rectangulo, recorrido con otro
+    paso, y la podemos leer con un slice de numpy, sin indices.  Para
+    las demas guardamos, una sola vez, un arreglo plano con el indice
+    de la imagen de cada pixel.  Las imagenes que caen fuera de la
+    pantalla apuntan a un pixel extra al final, que vale -1, asi que
+    sumarle uno da 0 y nunca gana el maximo; eso hace las veces de la
+    mascara.  En los dos casos, cada cuadro es un add y un maximum in
+    situ por transformacion, sobre dos arreglos que se turnan.
 
-    bounded_coords.append((Numeric.where(in_bounds, xps, xs),
-                           Numeric.where(in_bounds, yps, ys),
-                           in_bounds))
-
-lower_bounds = Numeric.zeros((ww, hh))
+    Despues de cada paso, changed tiene los indices de los pixeles que
+    cambiaron (None si no sabemos).  Un pixel solo puede cambiar si
+    cambio alguna de sus imagenes, asi que cuando cambiaron pocos
+    recalculamos solamente las preimagenes de esos; cuando no cambio
+    ninguno, el campo convergio y ya no hay nada que hacer.
+    """
+    sparse = 16                 # recorremos todo si cambio mas de 1/sparse
+    def __init__(self, size, transforms, limit):
+        "limit es la cota mas alta que vale la pena distinguir."
+        ww, hh = size
+        self.size, self.limit, self.npixels = size, limit, ww * hh
+        ys, xs = numpy.indices((hh, ww))  # fila por fila, como la pantalla
+        self.slices, self.indices = [], []
+        for a, b, c, d, e, f in transforms:
+            slices = self.slices_for(a, b, c, d, e, f)
+            if slices is not None:
+                self.slices.append(slices)
+                continue
+            xps = numpy.floor(a * xs + b * ys + c).astype(numpy.intp)
+            yps = numpy.floor(d * xs + e * ys + f).astype(numpy.intp)
+            in_bounds = (xps >= 0) & (xps < ww) & (yps >= 0) & (yps < hh)
+            self.indices.append(numpy.where(in_bounds, yps * ww + xps,
+                                            self.npixels).ravel())
+        self.lower_bounds = numpy.zeros(self.npixels + 1, numpy.int32)
+        self.new_lower_bounds = self.lower_bounds.copy()
+        self.lower_bounds[-1] = self.new_lower_bounds[-1] = -1
+        self.images = numpy.zeros(self.npixels, numpy.int32)
+        self.inverses = [None] * len(self.indices)
+        self.changed = None
+    def slices_for(self, a, b, c, d, e, f):
+        """Si la transformacion es de las faciles, devuelve (filas,
+        columnas, transpuesta, filas_imagen, columnas_imagen): los
+        slices de los pixeles que caen adentro, si hay que leer la
+        imagen transpuesta, y los slices de sus imagenes.  Si no,
+        None."""
+        ww, hh = self.size
+        if any(k != int(k) for k in (a, b, c, d, e, f)): return None
+        a, b, c, d, e, f = [int(k) for k in (a, b, c, d, e, f)]
+        if b == d == 0 and a and e:
+            # fila y -> fila e*y + f, columna x -> columna a*x + c
+            transposed, rows, cols = False, (e, f, hh), (a, c, ww)
+        elif a == e == 0 and b and d:
+            # fila y -> columna b*y + c, columna x -> fila d*x + f
+            transposed, rows, cols = True, (b, c, ww), (d, f, hh)
+        else: return None
+        rv = [transposed]
+        for (step, offset, limit), n in (rows, hh), (cols, ww):
+            images = numpy.arange(n) * step + offset
+            inside = numpy.flatnonzero((images >= 0) & (images < limit))
+            if not len(inside): return None
+            first, count = int(inside[0]), len(inside)
+            start = int(images[first])
+            stop = start + step * count
+            rv.append((slice(first, first + count),
+                       slice(start, stop if stop >= 0 else None, step)))
+        transposed, (rows, image_rows), (cols, image_cols) = rv
+        return rows, cols, transposed, image_rows, image_cols
+    def converged(self):
+        return self.changed is not None and not len(self.changed)
+    def step(self):
+        "Calcula un cuadro mas."
+        ntransforms = len(self.slices) + len(self.indices)
+        if (self.changed is None or
+            len(self.changed) * ntransforms > self.npixels / self.sparse):
+            self.sweep()
+        else:
+            self.update(self.dependents(self.changed))
+    def sweep(self):
+        "Recalcula todos los pixeles."
+        ww, hh = self.size
+        old, new = self.lower_bounds, self.new_lower_bounds
+        pixels, images = new[:-1], self.images
+        pixels[:] = old[:-1]
+        old2d, new2d = old[:-1].reshape(hh, ww), pixels.reshape(hh, ww)
+        for rows, cols, transposed, image_rows, image_cols in self.slices:
+            source = old2d.T if transposed else old2d
+            destination = new2d[rows, cols]
+            shape = destination.shape
+            images2d = images[:shape[0] * shape[1]].reshape(shape)
+            numpy.add(source[image_rows, image_cols], 1, images2d)
+            numpy.maximum(destination, images2d, destination)
+        for index in self.indices:
+            numpy.take(old, index, out=images, mode='clip')
+            numpy.add(images, 1, images)
+            numpy.maximum(pixels, images, pixels)
+        numpy.minimum(pixels, self.limit, pixels)
+        self.changed = numpy.flatnonzero(pixels != old[:-1])
+        self.lower_bounds, self.new_lower_bounds = new, old
+    def update(self, which):
+        """Recalcula solo los pixeles which, en el mismo arreglo: leemos
+        todas las imagenes antes de escribir nada."""
+        field = self.lower_bounds
+        current = field[which]
+        best = current.copy()
+        for images in self.images_of(which):
+            numpy.maximum(best, field[images] + 1, best)
+        numpy.minimum(best, self.limit, best)
+        moved = best != current
+        self.changed = which[moved]
+        field[self.changed] = best[moved]
+    def images_of(self, which):
+        """Para cada transformacion, los indices de las imagenes de los
+        pixeles which (o del pixel extra, si caen afuera)."""
+        ww, hh = self.size
+        ys, xs = numpy.divmod(which, ww)
+        for rows, cols, transposed, image_rows, image_cols in self.slices:
+            image_ys = image_rows.start + (ys - rows.start) * image_rows.step
+            image_xs = image_cols.start + (xs - cols.start) * image_cols.step
+            if transposed: image_ys, image_xs = image_xs, image_ys
+            inside = ((ys >= rows.start) & (ys < rows.stop) &
+                      (xs >= cols.start) & (xs < cols.stop))
+            yield numpy.where(inside, image_ys * ww + image_xs, self.npixels)
+        for index in self.indices:
+            yield index[which]
+    def dependents(self, changed):
+        "Los pixeles que tienen alguna imagen entre los pixeles changed."
+        ww, hh = self.size
+        found = []
+        ys, xs = numpy.divmod(changed, ww)
+        for rows, cols, transposed, image_rows, image_cols in self.slices:
+            image_ys, image_xs = (xs, ys) if transposed else (ys, xs)
+            dys, ry = numpy.divmod(image_ys - image_rows.start, image_rows.step)
+            dxs, rx = numpy.divmod(image_xs - image_cols.start, image_cols.step)
+            ok = ((ry == 0) & (rx == 0) &
+                  (dys >= 0) & (dys < rows.stop - rows.start) &
+                  (dxs >= 0) & (dxs < cols.stop - cols.start))
+            found.append((dys[ok] + rows.start) * ww + dxs[ok] + cols.start)
+        for ii, index in enumerate(self.indices):
+            if self.inverses[ii] is None:
+                # la inversa, como en una matriz rala: los pixeles cuya
+                # imagen es p son order[starts[p]:starts[p+1]]
+                order = numpy.argsort(index, kind='mergesort')
+                starts = numpy.searchsorted(index[order],
+                                            numpy.arange(self.npixels + 1))
+                self.inverses[ii] = order, starts
+            order, starts = self.inverses[ii]
+            first, counts = starts[changed], starts[changed + 1] - starts[changed]
+            offsets = numpy.repeat(first - numpy.cumsum(counts) + counts, counts)
+            found.append(order[offsets + numpy.arange(len(offsets))])
+        return numpy.unique(numpy.concatenate(found + [changed[:0]]))
+    def field(self):
+        "Las cotas, como un arreglo de filas de la pantalla."
+        ww, hh = self.size
+        return self.lower_bounds[:-1].reshape(hh, ww)
 
 def hsva(hh, ss, vv, aa):
     rv = pygame.Color(0)
     rv.hsva = hh, ss, vv, aa
     return int(rv)
 
-hues = [random.randrange(360) for ii in range(3)]
-palette = [hsva(random.choice(hues),
-                random.randrange(25, 100),
-                random.randrange(0, 100),
-                100)
-           for ii in range(500)]
+def random_palette():
+    hues = [random.randrange(360) for ii in range(3)]
+    return numpy.array([hsva(random.choice(hues),
+                             random.randrange(25, 100),
+                             random.randrange(0, 100),
+                             100)
+                        for ii in range(500)], numpy.uint32)
+
+def show(field, palette, changed=None):
+    """Pinta las cotas en la pantalla; si sabemos cuales cambiaron,
+    solamente esas."""
+    try:
+        # directo en la memoria de la pantalla, sin copiar
+        pixels = pygame.surfarray.pixels2d(pantalla).T
+    except ValueError:                  # no hay pixels2d en 24 bits
+        pygame.surfarray.blit_array(pantalla, numpy.take(palette, field).T)
+        return
+    palette = palette.astype(pixels.dtype, copy=False)
+    if changed is None:
+        numpy.take(palette, field, out=pixels, mode='clip')
+    else:
+        ys, xs = numpy.divmod(changed, field.shape[1])
+        pixels[ys, xs] = numpy.take(palette, field[ys, xs])
 
-def take2(pixels, xx, yy):
-    ww, hh = pixels.shape
-    return Numeric.take(Numeric.reshape(pixels, (ww*hh,)), xx * hh + yy)
+palette = random_palette()
+ifs = IFS((ww, hh), transforms, len(palette) - 1)
+repaint = True
 
 while True:
-    ev = pygame.event.poll()
+    # Si ya convergio no hay nada que calcular ni que pintar hasta que
+    # pase algo.
+    if ifs.converged() and not repaint:
+        ev = pygame.event.wait()
+    else:
+        ev = pygame.event.poll()
     if ev.type in (pygame.QUIT, pygame.MOUSEBUTTONDOWN):
         break
+    elif ev.type == pygame.KEYDOWN and ev.key == pygame.K_SPACE:
+        palette, repaint = random_palette(), True
+        continue
+    elif ev.type == pygame.KEYDOWN and ev.key == pygame.K_t:
+        if alucinantes[0] in transforms:
+            transforms = transforms[:-len(alucinantes)]
+        else:
+            transforms = transforms + alucinantes
+        ifs, repaint = IFS((ww, hh), transforms, len(palette) - 1), True
+        continue
     elif ev.type != pygame.NOEVENT:
         continue
-    
-    pygame.surfarray.blit_array(pantalla, Numeric.take(palette, lower_bounds))
-    pygame.display.flip()
 
-    new_lower_bounds = lower_bounds
-    for xps, yps, in_bounds in bounded_coords:
-        new_lower_bounds = Numeric.where(in_bounds,
-                                         Numeric.maximum(
-                                             take2(lower_bounds, xps, yps) + 1,
-                                             new_lower_bounds),
-                                         new_lower_bounds)
+    show(ifs.field(), palette, None if repaint else ifs.changed)
+    pygame.display.flip()
+    repaint = False
 
-    lower_bounds = new_lower_bounds
+    ifs.step()
@@ -0,0 +1,22 @@
+#!/usr/bin/python
+# Lo mismo que sintesis2.py, pero calculando el sonido de a bloques
+# tan largos como el buffer del mixer mientras suena, con un banco de
+# osciladores: cambiar la nota o los armonicos no corta la onda, asi
+# que no hace falta fadeout.
+
+from pygame import mixer, time, init
+from oscbank import OscillatorBank
+tasa = 22050                            # de muestreo
+
+buffer = 512                            # chico: menos latencia
+mixer.pre_init(tasa, -16, 1, buffer)
+init()
+armonicos = [1, 1, 2, 2, 4, 8, 3, 5, 6]
+banco = OscillatorBank(len(armonicos), buffer=buffer)
+banco.start()
+for ii in range(1, 14):
+    hz = 440 * pow(2, ii/12.0)
+    for jj, armonico in enumerate(armonicos):
+        banco.set(jj, armonico * hz, 512 if jj < ii else 0)
+    time.wait(1000)                     # un segundo por nota
+banco.stop()
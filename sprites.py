@@ -0,0 +1,78 @@
+#!/usr/bin/python
+"""Lots of sprites at once, for circles.py and ellipses.py.
+
+The state of all the sprites lives in NumPy arrays, so moving them is
+one vectorized step no matter how many there are, and drawing them is
+a single Surface.blits call, so the per-sprite work left in Python is
+building one tuple.  Rotated sprites come from a RotationCache of
+each image rotated to one of a fixed number of angles, since
+transform.rotate is far too slow to call for every sprite on every
+frame; the rotations that don't fit in it are still computed every
+frame, but only once per image and angle, however many sprites
+share it.
+"""
+import numpy, pygame, rotcache
+
+class Sprites:
+    """A set of sprites drifting around a torus of the given size.
+
+    images has one Surface per sprite; sprites can share a Surface,
+    and then they share its rotations too.  positions, velocities
+    (pixels per step), angles and spins (degrees per step) are
+    sequences with one item per sprite.  If rotations is given, each
+    sprite is drawn rotated by its angle rounded to the nearest of
+    that many angles evenly spaced around the circle; the rotated
+    images come from cache, a rotcache.RotationCache with that many
+    steps, which can be shared with other sprite sets, or one of our
+    own by default.
+    """
+    def __init__(self, size, images, positions, velocities=None,
+                 angles=None, spins=None, rotations=None, cache=None):
+        nsprites = len(images)
+        self.size = numpy.array(size, float)
+        self.images = list(images)
+        kinds, self.distinct = {}, []
+        for image in self.images:
+            if id(image) not in kinds:
+                kinds[id(image)] = len(self.distinct)
+                self.distinct.append(image)
+        self.kinds = numpy.array([kinds[id(image)] for image in self.images],
+                                 int)
+        self.positions = numpy.array(positions, float).reshape(nsprites, 2)
+        self.velocities = self.array(velocities, (nsprites, 2))
+        self.angles = self.array(angles, nsprites)
+        self.spins = self.array(spins, nsprites)
+        self.rotations = rotations
+        self.cache = cache
+        if rotations and cache is None:
+            self.cache = rotcache.RotationCache(rotations)
+
+    def array(self, values, shape):
+        if values is None: return numpy.zeros(shape)
+        return numpy.array(values, float).reshape(shape)
+
+    def __len__(self):
+        return len(self.images)
+
+    def step(self, dt=1):
+        "Move every sprite dt steps further, wrapping around the edges."
+        self.positions += self.velocities * dt
+        numpy.remainder(self.positions, self.size, self.positions)
+        if self.rotations:
+            self.angles += self.spins * dt
+            numpy.remainder(self.angles, 360, self.angles)
+
+    def draw(self, surface):
+        "Blit every sprite onto surface, in order, at its top left corner."
+        corners = self.positions.astype(int).tolist()
+        if not self.rotations:
+            surface.blits(zip(self.images, corners), 0)
+            return
+        quanta = numpy.rint(self.angles * (self.rotations / 360.0)).astype(int)
+        keys = (self.kinds * self.rotations + quanta % self.rotations).tolist()
+        rotated = {}
+        for key in set(keys):
+            kind, quantum = divmod(key, self.rotations)
+            rotated[key] = self.cache.get(self.distinct[kind],
+                                          quantum * 360.0 / self.rotations)
+        surface.blits(zip([rotated[key] for key in keys], corners), 0)
@@ -15,6 +15,7 @@
    '(mode-line ((t (:background "#001111" :foreground "#770000")))))
   (scroll-bar-mode 0)
   (pctalk-setup-keys)
+  (pctalk-start-zygote)
   (pctalk-resize-screen))
 
 (defun pctalk-resize-screen ()
@@ -29,11 +30,46 @@
   (shell-command "xrandr -s \"$(xrandr | head -3 | tail -1 | awk '{print $1}')\""))
 
 (defun pctalk-compile-this-buffer ()
-  "Execute the script in the current buffer in the shell."
+  "Execute the script in the current buffer, in the zygote if it's running."
   (interactive)
   (save-buffer)
-  (shell-command (buffer-file-name))
-  (pctalk-maxsize-screen))
+  (if (and pctalk-zygote (eq (process-status pctalk-zygote) 'run))
+      (process-send-string pctalk-zygote (concat (buffer-file-name) "\n"))
+    (shell-command (buffer-file-name))
+    (pctalk-maxsize-screen)))
+
+;;; Starting Python and PyGame for every demo takes a couple of
+;;; seconds; zygote.py does it once and then runs each demo we send it
+;;; right away.  It says when each demo shows its first frame and when
+;;; it's done, in the *zygote* buffer.
+
+(defvar pctalk-zygote nil
+  "The zygote.py process running the demos, if any.")
+
+(defun pctalk-start-zygote ()
+  "Start zygote.py, so that demos start without waiting for PyGame."
+  (interactive)
+  (if (and pctalk-zygote (eq (process-status pctalk-zygote) 'run))
+      (message "The zygote is already running.")
+    (setq pctalk-zygote
+          (start-process "zygote" "*zygote*" "python"
+                         (expand-file-name "zygote.py")))
+    (set-process-filter pctalk-zygote 'pctalk-zygote-filter)))
+
+(defun pctalk-stop-zygote ()
+  "Stop zygote.py; demos go back to running in the shell."
+  (interactive)
+  (when pctalk-zygote
+    (process-send-eof pctalk-zygote)
+    (setq pctalk-zygote nil)))
+
+(defun pctalk-zygote-filter (process output)
+  "Log what the zygote says, and fix the screen when a demo is done."
+  (with-current-buffer (process-buffer process)
+    (goto-char (point-max))
+    (insert output))
+  (if (string-match "^done " output)
+      (pctalk-maxsize-screen)))
 
 ;;; These two stacks of filenames form a sequence of files you can
 ;;; move back and forth along with pctalk-prev-file and
@@ -49,7 +85,7 @@
     "polygons.py"
     "circles.py"
     "reloj.py"
-    "sintesis0.py" "sintesis1.py" "sintesis2.py"
+    "sintesis0.py" "sintesis1.py" "sintesis2.py" "sintesis3.py"
     "ondas.py" "klappquadrat.py"
     "pygmusic.py")
   "Files still to display in the presentation.")
@@ -85,4 +121,5 @@
   (interactive)
   (global-set-key (kbd "M-S-<left>") 'pctalk-prev-file)
   (global-set-key (kbd "M-S-<right>") 'pctalk-next-file)
-  (global-set-key (kbd "M-S-<up>") 'pctalk-compile-this-buffer))
+  (global-set-key (kbd "M-S-<up>") 'pctalk-compile-this-buffer)
+  (global-set-key (kbd "M-S-<down>") 'pctalk-start-zygote))
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+"""Harmonic tones from wavetables, computed once and reused.
+
+sintesis2.py builds each note by adding up a sine wave for every
+harmonic, over the whole length of the note.  Here a spectrum, a list
+of (harmonic, amplitude) pairs, is added up just once, over a single
+period, into a table; a tone at any pitch is then read out of the
+table with a phase increment, interpolating linearly between entries.
+The length of a tone is rounded to a whole number of periods, nudging
+the increment a hair so that they fit exactly, so tones loop without a
+click.
+
+Finished Sounds are memoized by (spectrum, pitch, length), and the
+least recently used are forgotten once they add up to more than the
+budget, so playing the same notes again, or a chord of notes already
+played, costs nothing.  The wavetables themselves are kept for the
+most recently used ntables spectra.
+"""
+import pygame, numpy, collections
+
+tablesize = 4096
+
+class Wavetable:
+    "One period of a spectrum, tablesize samples long."
+    def __init__(self, spectrum):
+        phases = numpy.arange(tablesize) * (2 * numpy.pi / tablesize)
+        self.table = numpy.zeros(tablesize + 1)  # repeats [0] at the end
+        for harmonic, amplitude in spectrum:
+            self.table[:-1] += amplitude * numpy.sin(harmonic * phases)
+        self.table[-1] = self.table[0]
+
+    def samples(self, hz, length, rate):
+        """An array of about length samples of the tone at hz, looping
+        seamlessly, as int16."""
+        periods = max(1, int(round(length * hz / float(rate))))
+        length = max(1, int(round(periods * rate / float(hz))))
+        positions = numpy.arange(length) * (periods * tablesize /
+                                            float(length)) % tablesize
+        indices = positions.astype(int)
+        positions -= indices            # now the fraction between entries
+        before = self.table[indices]
+        rv = before + (self.table[indices + 1] - before) * positions
+        return numpy.clip(rv, -32767, 32767).astype(numpy.int16)
+
+class ToneCache:
+    """Sounds of spectra at pitches, up to budget bytes of them, and
+    wavetables of up to ntables spectra."""
+    def __init__(self, budget=64 * 1024 * 1024, ntables=64):
+        self.budget, self.bytes = budget, 0
+        self.ntables = ntables
+        self.tables = collections.OrderedDict()  # spectrum -> Wavetable
+        self.sounds = collections.OrderedDict()  # -> (Sound, bytes), LRU first
+        self.hits = self.misses = 0
+
+    def tone(self, spectrum, hz, length):
+        """A looping Sound of spectrum at hz, about length samples long.
+
+        spectrum is a sequence of (harmonic, amplitude) pairs, with
+        amplitude in sample units; a harmonic may appear more than
+        once."""
+        spectrum = canonical(spectrum)
+        key = spectrum, hz, length
+        entry = self.sounds.pop(key, None)
+        if entry is not None:
+            self.hits += 1
+            self.sounds[key] = entry
+            return entry[0]
+        self.misses += 1
+        rate, format, channels = pygame.mixer.get_init()
+        samples = self.table(spectrum).samples(hz, length, rate)
+        if channels > 1:
+            samples = numpy.repeat(samples[:, None], channels, axis=1)
+        sound = pygame.sndarray.make_sound(samples)
+        self.sounds[key] = sound, samples.nbytes
+        self.bytes += samples.nbytes
+        while self.bytes > self.budget and len(self.sounds) > 1:
+            self.bytes -= self.sounds.popitem(last=False)[1][1]
+        return sound
+
+    def table(self, spectrum):
+        "The Wavetable for a canonical spectrum, made if need be."
+        table = self.tables.pop(spectrum, None)
+        if table is None: table = Wavetable(spectrum)
+        self.tables[spectrum] = table
+        while len(self.tables) > self.ntables:
+            self.tables.popitem(last=False)
+        return table
+
+def canonical(spectrum):
+    "spectrum with repeated harmonics added together, as a sorted tuple."
+    amplitudes = collections.defaultdict(float)
+    for harmonic, amplitude in spectrum: amplitudes[harmonic] += amplitude
+    return tuple(sorted(amplitudes.items()))
+
+cache = ToneCache()
+
+def tone(spectrum, hz, length):
+    "A Sound from the module's ToneCache; see ToneCache.tone."
+    return cache.tone(spectrum, hz, length)
@@ -0,0 +1,179 @@
+#!/usr/bin/python
+"""Runs the demos one after another in a single, already warm process.
+
+Usage: zygote.py
+
+Starting each demo as a new process costs starting Python, importing
+PyGame and NumPy, initializing every PyGame subsystem, and opening the
+display and the sound device, which is seconds of dead air in the
+middle of the talk.  The zygote does all that once and then reads the
+names of demos to run from its standard input, one per line,
+optionally followed by arguments.  Each demo runs as __main__ in a
+fresh namespace, with sys.argv, sys.path and the current directory set
+up as if it had been run by itself.  The zygote then reports how long
+it took until the demo first flipped the display.
+
+To make that fast:
+- the display stays initialized, and display.set_mode with the same
+  size and flags as the window that's showing just clears and
+  returns it;
+- mixer.pre_init doesn't reopen the sound device unless the demo
+  asks for different settings than the last one;
+- image.load decodes each file only once (per modification time),
+  and hands out copies; the demos themselves are compiled only once
+  too.
+
+Modules imported from the demos' own directory are forgotten after
+each demo, so that editing them during the talk works as usual,
+although they're kept alive until any threads the demo left running
+finish, since Python empties a module when it's freed.  When
+a demo finishes, the window is iconified so that Emacs comes back,
+and the next demo's set_mode brings it back.  talk.el starts a
+zygote with pctalk-start-zygote.
+"""
+
+import sys, os, time, shlex, traceback, threading
+
+start = time.time()
+import pygame
+import numpy, pygame.surfarray, pygame.sndarray, multiprocessing.pool
+
+def say(*words):
+    print ' '.join(str(word) for word in words)
+    sys.stdout.flush()
+
+class Zygote:
+    "The patched-up PyGame shared by all the demos."
+    def __init__(self):
+        self.real_set_mode = pygame.display.set_mode
+        self.real_flip = pygame.display.flip
+        self.real_update = pygame.display.update
+        self.real_pre_init = pygame.mixer.pre_init
+        self.real_init = pygame.init
+        self.real_load = pygame.image.load
+        self.mode = None                # (size, flags, depth) of the window
+        self.mixer_settings = None      # what we last gave pre_init
+        self.wanted_mixer = None        # what the demo asked for
+        self.images = {}                # (path, mtime) -> Surface
+        self.code = {}                  # (path, mtime) -> compiled demo
+        self.demo = self.started = self.first_frame = None
+        self.leftovers = []             # (threads, modules) still running
+
+        pygame.display.set_mode = self.set_mode
+        pygame.display.flip = self.flip
+        pygame.display.update = self.update
+        pygame.mixer.pre_init = self.pre_init
+        pygame.init = self.init
+        pygame.image.load = self.load
+        pygame.quit = pygame.display.quit = lambda: None
+        self.real_init()
+
+    def set_mode(self, resolution=(0, 0), flags=0, depth=0):
+        mode = tuple(resolution), flags, depth
+        screen = pygame.display.get_surface()
+        if (screen is None or mode != self.mode
+            or not pygame.display.get_active()):
+            self.mode = mode
+            return self.real_set_mode(*mode)
+        screen.fill(0)
+        return screen
+
+    def frame(self):
+        if self.first_frame is None:
+            self.first_frame = time.time()
+            say(self.demo, 'first frame after %.1f ms' %
+                ((self.first_frame - self.started) * 1000))
+
+    def flip(self):
+        self.frame()
+        return self.real_flip()
+
+    def update(self, *rects):
+        self.frame()
+        return self.real_update(*rects)
+
+    def pre_init(self, frequency=22050, size=-16, channels=2, buffer=4096):
+        self.wanted_mixer = frequency, size, channels, buffer
+
+    def init(self):
+        "Reopen the mixer if the demo wants other settings; init the rest."
+        if (self.wanted_mixer is not None
+            and self.wanted_mixer != self.mixer_settings):
+            pygame.mixer.quit()
+            self.real_pre_init(*self.wanted_mixer)
+            self.mixer_settings = self.wanted_mixer
+        return self.real_init()
+
+    def load(self, filename, namehint=''):
+        "image.load, decoding each file only once."
+        if not isinstance(filename, basestring):
+            return self.real_load(filename, namehint)
+        path = os.path.abspath(filename)
+        key = path, os.path.getmtime(path)
+        if key not in self.images: self.images[key] = self.real_load(path)
+        return self.images[key].copy()
+
+    def compile(self, path):
+        key = path, os.path.getmtime(path)
+        if key not in self.code:
+            with open(path) as source:
+                self.code[key] = compile(source.read(), path, 'exec')
+        return self.code[key]
+
+    def run(self, argv):
+        "Run one demo, given as a command line, until it finishes."
+        path = os.path.abspath(argv[0])
+        directory = os.path.dirname(path)
+        self.demo, self.first_frame = argv[0], None
+        self.wanted_mixer = None
+        pygame.event.clear()
+        pygame.mouse.set_visible(True)
+        cwd, path0 = os.getcwd(), sys.path[0]
+        os.chdir(directory)
+        sys.argv, sys.path[0] = [path] + argv[1:], directory
+        threads = set(threading.enumerate())
+        self.started = time.time()
+        try:
+            # not runpy.run_path, which empties the namespace afterwards,
+            # under the feet of any threads the demo leaves running
+            namespace = {'__name__': '__main__', '__file__': path,
+                         '__builtins__': __builtins__}
+            exec self.compile(path) in namespace
+        except SystemExit: pass
+        except Exception:
+            traceback.print_exc()
+            sys.stdout.flush()
+        finally:
+            os.chdir(cwd)
+            sys.path[0] = path0
+            pygame.mixer.stop()
+            pygame.display.iconify()
+            threads = [thread for thread in threading.enumerate()
+                       if thread not in threads]
+            self.leftovers.append((threads, forget_modules(directory)))
+            self.leftovers = [(threads, modules)
+                              for threads, modules in self.leftovers
+                              if any(thread.is_alive() for thread in threads)]
+        say('done', self.demo, 'after %.1f s' % (time.time() - self.started))
+
+def forget_modules(directory):
+    """Drop modules imported from directory, so edits to them take
+    effect, and return them."""
+    forgotten = []
+    for name, module in sys.modules.items():
+        filename = getattr(module, '__file__', None)
+        if (name != '__main__' and filename and
+            os.path.dirname(os.path.abspath(filename)) == directory):
+            forgotten.append(sys.modules.pop(name))
+    return forgotten
+
+def main(argv):
+    zygote = Zygote()
+    say('ready after %.1f ms' % ((time.time() - start) * 1000))
+    while True:
+        line = sys.stdin.readline()
+        if not line: break
+        words = shlex.split(line)
+        if words: zygote.run(words)
+
+if __name__ == '__main__': main(sys.argv)